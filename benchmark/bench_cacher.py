@@ -0,0 +1,48 @@
+"""Save/load time of ArrayCacher against Zip7Cacher (and the in-process compressed cachers) on array payloads.
+`load` only maps the cache for ArrayCacher, `slice` adds reading 1 MB out of the loaded array.
+Run: python benchmark/bench_cacher.py --sizes 10 100 1000
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+from shutil import which
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import numpy as np
+from pypedream import ArrayCacher, Zip7Cacher, ZlibCacher, ZstdCacher
+from pypedream import fileobj
+
+def _time(fn):
+    start = perf_counter()
+    result = fn()
+    return perf_counter() - start, result
+
+def bench(cacher, folder: Path, payload: dict) -> tuple:
+    cache = cacher(folder.joinpath(cacher.__name__))
+    save_time, _ = _time(lambda: cache.save(payload))
+    load_time, result = _time(cache.load)
+    slice_time, _ = _time(lambda: float(result["image"][0: 131072].sum()))
+    return save_time, load_time, load_time + slice_time
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="payload sizes in MB")
+    parser.add_argument("--folder", type=Path, default=None, help="cache folder, a temp dir by default")
+    args = parser.parse_args()
+    cachers = [ArrayCacher, ZlibCacher]
+    if fileobj.zstd is not None:
+        cachers.append(ZstdCacher)
+    if which("7z") is not None:
+        cachers.append(Zip7Cacher)
+    else:
+        print("7z not found, skipping Zip7Cacher")
+    print(f"{'size':>6} {'cacher':>12} {'save (s)':>10} {'load (s)':>10} {'slice (s)':>10}")
+    with TemporaryDirectory(dir=args.folder) as folder:
+        for size in args.sizes:
+            rng = np.random.default_rng(0)  # noisy low bits, like real images, so compression isn't free
+            payload = {"image": rng.normal(size=size * 131072).astype(np.float64), "meta": {"size": size}}
+            for cacher in cachers:
+                save_time, load_time, slice_time = bench(cacher, Path(folder).joinpath(str(size)), payload)
+                print(f"{size:>4}MB {cacher.__name__:>12} {save_time:>10.3f} {load_time:>10.4f} {slice_time:>10.4f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Per-case logging overhead of `Task.run` in worker processes, for each `getLogger` mode at DEBUG and INFO.
+Every case is a cache hit, so the run is mostly the staleness check and its log lines. `none` is a logger without
+handlers, the floor the other modes are compared against.
+Run: python benchmark/bench_logging.py --cases 20000 2>/dev/null
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any
+import logging
+from pypedream import Task, Input, InputObj, Executor, ZlibCacher, getLogger
+
+class NumberInput(InputObj):
+    def load(self, *args) -> Any:
+        return int(self.name)
+
+    def time(self) -> float:
+        return 1.0
+
+class IndexedCacher(ZlibCacher):
+    """Looks the cache up in the stage index, so a hit costs the same however many cases there are."""
+    def __init__(self, file_path: Path):
+        super(IndexedCacher, self).__init__(file_path, index=True)
+
+def square(x):
+    return x * x
+
+def run(executor: Executor, cases: list, task: Task) -> float:
+    start = perf_counter()
+    executor.map(cases, task)
+    return (perf_counter() - start) / len(cases)
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--cases", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    with TemporaryDirectory() as folder:
+        Task.save_folder = Input.save_folder = Path(folder)
+        task = Task(square, "2019-04-26T17:12", file_cacher=IndexedCacher)(Input(NumberInput, "2019-04-26T17:12"))
+        cases = [str(x) for x in range(args.cases)]
+        none = logging.getLogger("bench-none")
+        none.propagate = False
+        none.addHandler(logging.NullHandler())
+        with Executor(workers=args.workers, chunksize=64, logger=none) as executor:
+            executor.map(cases, task)  # fill the cache
+        for level in ("DEBUG", "INFO"):
+            for mode in ("none", "mp", "queue", "worker"):
+                if mode == "none":
+                    logger = none
+                else:
+                    logger = getLogger("", str(Path(folder, f"{mode}.log")), level=level, mode=mode)
+                with Executor(workers=args.workers, chunksize=64, logger=logger) as executor:
+                    elapsed = run(executor, cases, task)
+                print(f"{level:>5} {mode:>6}: {elapsed * 1e6:.1f}us/case")
+
+if __name__ == '__main__':
+    main()
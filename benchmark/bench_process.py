@@ -0,0 +1,112 @@
+"""Throughput and idle CPU cost of pypedream.process pipelines.
+chain: items/s through three CPU-bound `map` stages of 2 workers each.
+idle: CPU seconds burnt by the workers of a 3-deep pipeline fed one item every 0.1 s, per second of wall time.
+trivial: items/s and per-item overhead of a single `map(lambda x: x + 1)` stage.
+chunks: items/s of the trivial pipeline for chunk sizes 1, 16 and 256.
+short: pipelines/s of many 100 item pipelines with 4 workers, forking them each time and on a `WorkerPool`.
+arrays: MB/s of numpy arrays from 1 MB to 1 GB through a `map` stage, pickled and through shared memory.
+Run: python benchmark/bench_process.py chain idle trivial chunks short arrays
+"""
+from argparse import ArgumentParser
+from resource import getrusage, RUSAGE_CHILDREN
+from time import perf_counter, sleep
+from pypedream import process as pr
+
+def cpu_work(x):
+    total = 0
+    for i in range(20000):
+        total += i * i
+    return x + (total & 1)
+
+def slow_source(count):
+    for x in range(count):
+        sleep(0.1)
+        yield x
+
+def _child_cpu() -> float:
+    usage = getrusage(RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def chain(items: int):
+    start = perf_counter()
+    stage = range(items) | pr.map(cpu_work, workers=2) | pr.map(cpu_work, workers=2) | pr.map(cpu_work, workers=2)
+    assert len(list(stage)) == items
+    elapsed = perf_counter() - start
+    print(f"chain: {items} items in {elapsed:.2f}s, {items / elapsed:.0f} items/s")
+
+def idle(items: int):
+    cpu = _child_cpu()
+    start = perf_counter()
+    stage = slow_source(items) | pr.map(abs, workers=4) | pr.map(abs, workers=4) | pr.map(abs, workers=4)
+    assert len(list(stage)) == items
+    elapsed = perf_counter() - start
+    print(f"idle: {(_child_cpu() - cpu) / elapsed:.2f} cpu-s per wall-s over {elapsed:.1f}s")
+
+def trivial(items: int, chunksize: int = 1):
+    start = perf_counter()
+    assert len(list(range(items) | pr.map(lambda x: x + 1, chunksize=chunksize))) == items
+    elapsed = perf_counter() - start
+    print(f"trivial: {items} items in {elapsed:.2f}s, {items / elapsed:.0f} items/s, {elapsed / items * 1e6:.1f}us/item"
+          f" (chunksize {chunksize})")
+
+def chunks(items: int):
+    for chunksize in (1, 16, 256):
+        trivial(items, chunksize)
+
+def add1(x):
+    return x + 1
+
+def short(pipelines: int):
+    for pool in (None, pr.WorkerPool(4)):
+        start = perf_counter()
+        for _ in range(pipelines):
+            assert len(list(pr.to_iterable(range(100) | pr.map(add1, workers=3), pool=pool))) == 100
+        elapsed = perf_counter() - start
+        print(f"short: {pipelines / elapsed:.0f} pipelines/s, {elapsed / pipelines * 1e3:.1f}ms/pipeline"
+              f" ({'pool' if pool else 'fork'})")
+        if pool is not None:
+            pool.close()
+
+def make_arrays(count: int, size: int):
+    import numpy as np
+    for i in range(count):
+        yield np.full(size, i % 256, dtype=np.uint8)
+
+def touch(x):
+    x[0] = 0
+    return x
+
+def arrays(total_mb: int, sizes=(1, 16, 256, 1024)):
+    for size_mb in sizes:
+        count = max(3, total_mb // size_mb)
+        for shared_memory in (None, 1 << 20):
+            start = perf_counter()
+            # one message per queue, as a 1 GB array is held by every stage it passes
+            pipeline = pr.to_iterable(make_arrays(count, size_mb << 20) | pr.map(touch), budget=3,
+                                      shared_memory=shared_memory)
+            assert sum(1 for _ in pipeline) == count
+            elapsed = perf_counter() - start
+            print(f"arrays: {size_mb} MB x {count} in {elapsed:.2f}s, {count * size_mb / elapsed:.0f} MB/s"
+                  f" ({'shared memory' if shared_memory else 'pickle'})")
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("modes", nargs="+", choices=["chain", "idle", "trivial", "chunks", "short", "arrays"])
+    parser.add_argument("--items", type=int, default=None)
+    args = parser.parse_args()
+    for mode in args.modes:
+        if mode == "chain":
+            chain(args.items or 600)
+        elif mode == "idle":
+            idle(args.items or 30)
+        elif mode == "trivial":
+            trivial(args.items or 1000000)
+        elif mode == "chunks":
+            chunks(args.items or 200000)
+        elif mode == "short":
+            short(args.items or 200)
+        elif mode == "arrays":
+            arrays(args.items or 2048)
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,49 @@
-from .fileobj import FileObj, Zip7Cacher, InputObj
-from .logger import getLogger
-from .task import Task, Input, get_result
-from .plotter import to_nx, draw_nx
+"""Submodules are imported on first use of a name, so `import pypedream` stays cheap for short scripts and for
+every worker process that imports it."""
+from typing import TYPE_CHECKING
+from importlib import import_module
 
-__all__ = ["FileObj", "Zip7Cacher", "InputObj", "getLogger", "Task", "Input", "to_nx", "draw_nx", "get_result"]
+if TYPE_CHECKING:
+    from .fileobj import (FileObj, Zip7Cacher, InputObj, CompressedCacher, ZstdCacher, Lz4Cacher, ZlibCacher,
+                          ArrayCacher)
+    from .index import CacheIndex
+    from .logger import getLogger
+    from .task import Task, Input, CaseContext, Executor, get_result, prefetch
+    from .scheduler import Scheduler
+    from .metrics import Metrics
+    from .planner import plan
+    from .plotter import to_nx, draw_nx
+    from .shard import run_shard, merge_shards
+
+_exports = {
+    "fileobj": ["FileObj", "Zip7Cacher", "InputObj", "CompressedCacher", "ZstdCacher", "Lz4Cacher", "ZlibCacher",
+                "ArrayCacher"],
+    "index": ["CacheIndex"],
+    "logger": ["getLogger"],
+    "task": ["Task", "Input", "CaseContext", "Executor", "get_result", "prefetch"],
+    "scheduler": ["Scheduler"],
+    "metrics": ["Metrics"],
+    "planner": ["plan"],
+    "plotter": ["to_nx", "draw_nx"],
+    "shard": ["run_shard", "merge_shards"],
+}
+_modules = {name: module for module, names in _exports.items() for name in names}
+_submodules = {"asyncio_task", "fileobj", "index", "lease", "logger", "metrics", "planner", "plotter", "process",
+               "scheduler", "shard", "task", "thread"}
+
+__all__ = ["FileObj", "Zip7Cacher", "InputObj", "CompressedCacher", "ZstdCacher", "Lz4Cacher", "ZlibCacher",
+           "ArrayCacher", "CacheIndex", "getLogger", "Task", "Input", "CaseContext", "Executor", "Scheduler", "plan",
+           "to_nx", "draw_nx", "get_result", "prefetch", "Metrics", "run_shard", "merge_shards"]
+
+def __getattr__(name: str):
+    if name in _modules:
+        value = getattr(import_module("." + _modules[name], __name__), name)
+    elif name in _submodules:
+        value = import_module("." + name, __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | _submodules)
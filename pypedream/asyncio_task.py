@@ -0,0 +1,184 @@
+"""Coroutine based stages with the API of `pypedream.process`. Each stage runs an event loop in its own thread and
+`workers` bounds the number of coroutines it has pending at once. Stages can be mixed with thread and process
+stages in one pipeline."""
+import asyncio
+from threading import Lock, Thread
+from time import monotonic
+from .process import (POLL_TIMEOUT, _QueueStatus, _Stage, _as_args, _report_exception,
+                      _from_iterable as _from_sync_iterable, _ordered_stage, Partial, to_iterable)
+
+__all__ = ["map", "filter", "concat", "from_iterable", "to_iterable"]
+
+_END = object()
+
+async def _call(f, *args):
+    """Calls `f`, which may be a plain or a coroutine function."""
+    result = f(*args)
+    if asyncio.iscoroutine(result):
+        result = await result
+    return result
+
+def _run(apply, workers, params, on_start=None, on_done=None):
+    """Awaits `apply(x, put, args)` for every input item with at most `workers` pending, where `args` is what
+    `on_start` returned. The input queue is read in an executor thread, so the loop keeps running while the stage
+    waits for data."""
+    lock = Lock()
+
+    def put(y):
+        with lock:
+            params.output_queues.put(y)
+
+    def flush():
+        with lock:
+            params.output_queues.flush()
+
+    async def guarded(x, args):
+        try:
+            await apply(x, put, args)
+        except BaseException as e:
+            _report_exception(params, e)
+
+    async def run():
+        try:
+            args = _as_args(await _call(on_start)) if on_start is not None else ()
+        except BaseException as e:
+            _report_exception(params, e)
+            return
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(workers)
+        items = params.input_queue.items(flush if params.output_queues.chunksize > 1 else None)
+        pending = set()
+        while True:
+            await semaphore.acquire()
+            x = await loop.run_in_executor(None, next, items, _END)
+            if x is _END:
+                break
+            task = loop.create_task(guarded(x, args))
+            pending.add(task)
+            task.add_done_callback(lambda task: (pending.discard(task), semaphore.release()))
+        if pending:
+            await asyncio.wait(pending)
+        params.stage_status._worker_done()
+        if on_done is not None:
+            try:
+                await _call(on_done, params.stage_status, *args)
+            except BaseException as e:
+                _report_exception(params, e)
+
+    asyncio.run(run())
+    params.output_queues.done()
+
+def _map(f, workers, on_start, on_done, params):
+    async def apply(x, put, args):
+        put(await f(x, *args))
+    _run(apply, workers, params, on_start, on_done)
+
+def _filter(f, workers, on_start, on_done, params):
+    async def apply(x, put, args):
+        if await f(x, *args):
+            put(x)
+    _run(apply, workers, params, on_start, on_done)
+
+def _map_tagged(f, workers, on_start, on_done, params):
+    async def apply(item, put, args):
+        index, x = item
+        put((index, True, await f(x, *args)))
+    _run(apply, workers, params, on_start, on_done)
+
+def _filter_tagged(f, workers, on_start, on_done, params):
+    async def apply(item, put, args):
+        index, x = item
+        put((index, bool(await f(x, *args)), x))
+    _run(apply, workers, params, on_start, on_done)
+
+def _stage(target, tagged, f, stage, workers, maxsize, ordered, window, chunksize, on_start, on_done):
+    stage = _to_stage(stage, chunksize)
+    args = (f, workers, on_start, on_done)
+    if ordered:
+        return _ordered_stage(tagged, args, stage, 1, maxsize, window, chunksize, Thread)
+    return _Stage(
+        worker_constructor=Thread,
+        workers=1,
+        maxsize=maxsize,
+        target=target,
+        args=args,
+        dependencies=[stage],
+        chunksize=chunksize,
+    )
+
+def map(f, stage=_QueueStatus.UNDEFINED, workers=1, maxsize=0, ordered=False, window=64, chunksize=1, on_start=None,
+        on_done=None):
+    """Same as `pypedream.process.map` for a coroutine function `f`. `workers` is the number of calls to `f`
+    awaited concurrently. The stage is a single worker, so `on_start` and `on_done`, plain or coroutine functions,
+    run once for the stage."""
+    if stage == _QueueStatus.UNDEFINED:
+        return Partial(lambda stage: map(f, stage, workers=workers, maxsize=maxsize, ordered=ordered, window=window,
+                                         chunksize=chunksize, on_start=on_start, on_done=on_done))
+    return _stage(_map, _map_tagged, f, stage, workers, maxsize, ordered, window, chunksize, on_start, on_done)
+
+def filter(f, stage=_QueueStatus.UNDEFINED, workers=1, maxsize=0, ordered=False, window=64, chunksize=1,
+           on_start=None, on_done=None):
+    """Same as `pypedream.process.filter` for a coroutine predicate `f`. `workers` is the number of calls to `f`
+    awaited concurrently, `on_start` and `on_done` run once for the stage."""
+    if stage == _QueueStatus.UNDEFINED:
+        return Partial(lambda stage: filter(f, stage, workers=workers, maxsize=maxsize, ordered=ordered,
+                                            window=window, chunksize=chunksize, on_start=on_start, on_done=on_done))
+    return _stage(_filter, _filter_tagged, f, stage, workers, maxsize, ordered, window, chunksize, on_start,
+                  on_done)
+
+def _concat(params):
+    for x in params.input_queue.items(params.output_queues.flush if params.output_queues.chunksize > 1 else None):
+        params.output_queues.put(x)
+    params.output_queues.done()
+
+def concat(stages, maxsize=0, chunksize=1):
+    """Same as `pypedream.process.concat`, running in a thread."""
+    return _Stage(
+        worker_constructor=Thread,
+        workers=1,
+        maxsize=maxsize,
+        target=_concat,
+        args=tuple(),
+        dependencies=[_to_stage(s, chunksize) for s in stages],
+        chunksize=chunksize,
+    )
+
+def _from_iterable(iterable, params):
+    if not hasattr(iterable, "__aiter__"):
+        return _from_sync_iterable(iterable, params)
+
+    async def run():
+        checked = monotonic()
+        async for x in iterable:
+            params.output_queues.put(x)
+            now = monotonic()
+            if now - checked > POLL_TIMEOUT:
+                if params.pipeline_error.is_set():
+                    return
+                checked = now
+
+    asyncio.run(run())
+    params.output_queues.done()
+
+def _to_stage(obj, chunksize=1):
+    if isinstance(obj, _Stage):
+        return obj
+    elif hasattr(obj, "__iter__") or hasattr(obj, "__aiter__"):
+        return from_iterable(obj, chunksize=chunksize)
+    else:
+        raise ValueError("Object {obj} is not iterable".format(obj=obj))
+
+def from_iterable(iterable=_QueueStatus.UNDEFINED, maxsize=None, chunksize=1):
+    """Same as `pypedream.process.from_iterable`, iterating in a thread. `iterable` may also be an async
+    iterable, which is consumed on an event loop of that thread."""
+    if iterable == _QueueStatus.UNDEFINED:
+        return Partial(lambda iterable: from_iterable(iterable, maxsize=maxsize, chunksize=chunksize))
+    return _Stage(
+        worker_constructor=Thread,
+        workers=1,
+        maxsize=maxsize or 0,
+        target=_from_iterable,
+        args=(iterable, ),
+        dependencies=[],
+        chunksize=chunksize,
+    )
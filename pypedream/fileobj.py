@@ -1,16 +1,39 @@
-from typing import Optional, Any, Dict
-from os import devnull
+from typing import Optional, Any, Dict, IO, Iterator, List
+from os import devnull, replace
+from contextlib import contextmanager
+from uuid import uuid4
+import io
+import sys
+import hashlib
+import gzip
+import mmap
+import struct
 import pickle as pkl
 import subprocess as sp
 from pathlib import Path
+from .index import CacheIndex
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
 
 SIZE_THRESHOLD = 204800
 
 class FileObj(object):
-    """Save and load cached data. Implement this class to cache file in non-pickle format."""
+    """Save and load cached data. Implement this class to cache file in non-pickle format.
+    With `index=True` the built-in cachers look up the current file of a case in the stage's `CacheIndex`
+    instead of globbing the stage folder. They set `bytes_read` and `bytes_written` to the file size on load and
+    save, for the stage metrics."""
+    bytes_read: Optional[int] = None
+    bytes_written: Optional[int] = None
 
-    def __init__(self, file_path: Path):
+    def __init__(self, file_path: Path, index: bool = False):
         self.file_path = file_path.resolve().with_suffix("")
+        self.index = index
 
     def load(self) -> Any:
         raise NotImplementedError
@@ -24,11 +47,61 @@ class FileObj(object):
 
     @staticmethod
     def _get_recent(file_path: Path) -> Optional[Path]:
-        entries = list(file_path.parent.glob(file_path.name + ".*"))
+        entries = list()
+        for entry in file_path.parent.glob(file_path.name + ".*"):
+            try:
+                entries.append((entry.stat().st_mtime, entry))
+            except FileNotFoundError:  # removed by another process since the glob
+                pass
         if len(entries) == 0:
             return None
-        entries = sorted(entries, key=lambda x: x.stat().st_mtime)
-        return entries[-1]
+        return max(entries)[1]
+
+    def _recent(self) -> Optional[Path]:
+        if self.index:
+            entry = CacheIndex(self.file_path.parent).get(self.file_path.name)
+            return None if entry is None else self.file_path.parent.joinpath(entry.file)
+        return self._get_recent(self.file_path)
+
+    def _recent_time(self) -> float:
+        if self.index:
+            entry = CacheIndex(self.file_path.parent).get(self.file_path.name)
+            return 0 if entry is None else entry.mtime
+        result = self._get_recent(self.file_path)
+        return 0 if result is None else result.stat().st_mtime
+
+    def _load_recent(self) -> Any:
+        file_path = self._recent()
+        assert file_path is not None
+        self.bytes_read = file_path.stat().st_size
+        return self._load(file_path)
+
+    @staticmethod
+    def _load(file_path: Path) -> Any:
+        raise NotImplementedError
+
+    def _saved(self, file_path: Path):
+        """Called by `save` once `file_path` is in place."""
+        self.bytes_written = file_path.stat().st_size
+        if self.index:
+            CacheIndex(self.file_path.parent).put(self.file_path.name, file_path)
+
+def _temp_path(file_path: Path) -> Path:
+    """Unique hidden sibling of `file_path` with the same suffix. The leading dot keeps it out of
+    `FileObj._get_recent`."""
+    return file_path.with_name(f".{file_path.stem}.{uuid4().hex}{file_path.suffix}")
+
+@contextmanager
+def _atomic_path(file_path: Path) -> Iterator[Path]:
+    """Yield a temporary path and rename it over `file_path` on success, so concurrent readers see either
+    the previous file or the complete new one, never a partial write."""
+    temp_path = _temp_path(file_path)
+    try:
+        yield temp_path
+        replace(temp_path, file_path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
 
 class InputObj(object):
     isInputObj = True
@@ -43,41 +116,235 @@ class InputObj(object):
     def time(self) -> float:
         raise NotImplementedError
 
+    @classmethod
+    def batch(cls, data_folder: Path, names: List[str]) -> Optional[Dict[str, "InputObj"]]:
+        """Loaders for many cases at once by name, e.g. built from a single listing of `data_folder` instead of a
+        scan per case, with `time` and `load` using what the listing found. Cases left out get their own loader.
+        None if the loader has no bulk lookup."""
+        return None
+
+    def digest(self, *args) -> Optional[str]:
+        """Content digest for hash-invalidated consumers, e.g. a checksum of the input file.
+        If None the loaded data is hashed instead."""
+        return None
+
+def content_hash(obj: Any) -> str:
+    """Hash of an object's pickle. Large buffers such as array data are hashed in place, without copying."""
+    digest = hashlib.blake2b(digest_size=16)
+
+    def hash_buffer(buffer: pkl.PickleBuffer) -> None:
+        digest.update(buffer.raw())
+    digest.update(pkl.dumps(obj, protocol=5, buffer_callback=hash_buffer))
+    return digest.hexdigest()
+
 class Zip7Cacher(FileObj):
     """Pickle the file and then 7z it if it's too big."""
 
     def time(self) -> float:
-        result = self._get_recent(self.file_path)
-        return 0 if result is None else result.stat().st_mtime
+        return self._recent_time()
 
     def load(self) -> Any:
         """Check if a file after `time` exists."""
-        file_path = self._get_recent(self.file_path)
-        assert file_path is not None
-        return self._load(file_path)
+        return self._load_recent()
 
     @staticmethod
     def _load(file_path: Path) -> Any:
+        """Archives are decompressed to memory through 7z's stdout, nothing is written next to the cache."""
         ext = file_path.suffix
         if ext == ".7z":
             with open(devnull, 'w') as fnull:
-                sp.run(["7z", "e", file_path, f"-o{file_path.parent}"], stdout=fnull)
+                output = sp.run(["7z", "e", "-so", file_path], stdout=sp.PIPE, stderr=fnull, check=True)
+            return pkl.loads(output.stdout)
         elif ext != ".pkl":
             raise IOError(f"cannot find cache: {file_path}")
-        with open(file_path.with_suffix(".pkl"), 'rb') as bfp:
-            result = pkl.load(bfp)
-        if ext != ".pkl":
-            file_path.with_suffix(".pkl").unlink()
-        return result
+        with open(file_path, 'rb') as bfp:
+            return pkl.load(bfp)
 
     def save(self, obj: Any):
         save_path = self.file_path.with_suffix(".pkl")
         folder = save_path.parent
         if not folder.exists():
             folder.mkdir(parents=True, exist_ok=True)
-        with open(save_path, 'wb') as fp:
-            pkl.dump(obj, fp)
-        if save_path.stat().st_size > SIZE_THRESHOLD:
-            with open(devnull, 'w') as fnull:
-                sp.run(["7z", "a", "-mx=1", save_path.with_suffix(".7z"), save_path], stdout=fnull)
-            save_path.unlink()
+        temp_path = _temp_path(save_path)
+        try:
+            with open(temp_path, 'wb') as fp:
+                pkl.dump(obj, fp)
+            if temp_path.stat().st_size > SIZE_THRESHOLD:
+                save_path = save_path.with_suffix(".7z")
+                with _atomic_path(save_path) as archive_path, open(devnull, 'w') as fnull:
+                    sp.run(["7z", "a", "-mx=1", archive_path, temp_path], stdout=fnull, check=True)
+            else:
+                replace(temp_path, save_path)
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+        self._saved(save_path)
+
+def _open_zstd(file_path: Path, mode: str, level: int) -> IO[bytes]:
+    if zstd is None:
+        raise ImportError("zstandard is required to read or write .zst caches")
+    if mode == 'wb':
+        return zstd.open(file_path, mode, cctx=zstd.ZstdCompressor(level=level))
+    return zstd.open(file_path, mode)
+
+def _open_lz4(file_path: Path, mode: str, level: int) -> IO[bytes]:
+    if lz4 is None:
+        raise ImportError("lz4 is required to read or write .lz4 caches")
+    if mode == 'wb':
+        return lz4.open(file_path, mode, compression_level=level)
+    return lz4.open(file_path, mode)
+
+def _open_gzip(file_path: Path, mode: str, level: int) -> IO[bytes]:
+    if mode == 'wb':
+        return gzip.open(file_path, mode, compresslevel=level)
+    return gzip.open(file_path, mode)
+
+_CODECS = {".zst": _open_zstd, ".lz4": _open_lz4, ".gz": _open_gzip}
+
+class _SpillWriter(object):
+    """Sink for the pickler. Holds the first `threshold` bytes in memory, then opens the compressed stream
+    and passes everything else straight through."""
+
+    def __init__(self, threshold: int, open_stream):
+        self.threshold = threshold
+        self.open_stream = open_stream
+        self.buffer: Optional[io.BytesIO] = io.BytesIO()
+        self.stream: Optional[IO[bytes]] = None
+
+    def write(self, data) -> int:
+        if self.stream is not None:
+            self.stream.write(data)
+        else:
+            self.buffer.write(data)  # type: ignore
+            if self.buffer.tell() > self.threshold:  # type: ignore
+                self.stream = self.open_stream()
+                self.stream.write(self.buffer.getbuffer())  # type: ignore
+                self.buffer = None
+        return memoryview(data).nbytes  # large buffers come in as PickleBuffer
+
+class CompressedCacher(FileObj):
+    """Stream pickle protocol 5 through an in-process compressor, without temporary files or a 7z subprocess.
+    Objects smaller than `threshold` bytes are saved as plain .pkl. Existing .7z/.pkl caches are still read,
+    and any codec reads the files of the others. Set `level` and `threshold` per Task with `cacher_options`."""
+    suffix = ".gz"
+    level = 1
+
+    def __init__(self, file_path: Path, level: Optional[int] = None, threshold: int = SIZE_THRESHOLD,
+                 index: bool = False):
+        super(CompressedCacher, self).__init__(file_path, index)
+        if level is not None:
+            self.level = level
+        self.threshold = threshold
+
+    def time(self) -> float:
+        return self._recent_time()
+
+    def load(self) -> Any:
+        return self._load_recent()
+
+    @staticmethod
+    def _load(file_path: Path) -> Any:
+        ext = file_path.suffix
+        if ext in _CODECS:
+            with _CODECS[ext](file_path, 'rb', 0) as bfp:
+                return pkl.load(bfp)
+        return Zip7Cacher._load(file_path)
+
+    def save(self, obj: Any):
+        folder = self.file_path.parent
+        if not folder.exists():
+            folder.mkdir(parents=True, exist_ok=True)
+        save_path = self.file_path.with_suffix(self.suffix)
+        temp_path = _temp_path(save_path)
+        writer = _SpillWriter(self.threshold, lambda: _CODECS[self.suffix](temp_path, 'wb', self.level))
+        try:
+            pkl.dump(obj, writer, protocol=5)
+            if writer.stream is not None:
+                writer.stream.close()
+                replace(temp_path, save_path)
+            else:
+                save_path = self.file_path.with_suffix(".pkl")
+                with _atomic_path(save_path) as pkl_path, open(pkl_path, 'wb') as fp:
+                    fp.write(writer.buffer.getbuffer())  # type: ignore
+        finally:
+            if writer.stream is not None:
+                writer.stream.close()
+            if temp_path.exists():
+                temp_path.unlink()
+        self._saved(save_path)
+
+class ZstdCacher(CompressedCacher):
+    """Pickle compressed with zstandard. Needs the `zstandard` package."""
+    suffix = ".zst"
+    level = 3
+
+class Lz4Cacher(CompressedCacher):
+    """Pickle compressed with lz4 frames. Needs the `lz4` package."""
+    suffix = ".lz4"
+    level = 0
+
+class ZlibCacher(CompressedCacher):
+    """Pickle compressed with gzip/zlib from the standard library."""
+    suffix = ".gz"
+    level = 1
+
+_NPK_MAGIC = b"PYPENPK1"
+_NPK_ALIGN = 64
+
+class ArrayCacher(FileObj):
+    """Cache NumPy arrays, or any nesting of dicts/lists/tuples holding them, without copying on load.
+    A bare ndarray is saved as .npy and loaded as a read-only `np.memmap`. Anything else is pickled with protocol 5
+    into a .npk file, its array buffers stored out-of-band and 64-byte aligned after the pickle stream. On load the
+    file is memory-mapped and arrays come back as read-only views into it, so only the pages actually touched are
+    read. Other cache formats (.pkl, .7z, .gz, ...) are still loaded."""
+
+    def time(self) -> float:
+        return self._recent_time()
+
+    def load(self) -> Any:
+        return self._load_recent()
+
+    @staticmethod
+    def _load(file_path: Path) -> Any:
+        ext = file_path.suffix
+        if ext == ".npy":
+            import numpy as np
+            return np.load(file_path, mmap_mode='r')
+        if ext == ".npk":
+            with open(file_path, 'rb') as fp:
+                view = memoryview(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+            if view[0: 8] != _NPK_MAGIC:
+                raise IOError(f"not an array cache: {file_path}")
+            pickle_size, buffer_no = struct.unpack_from("<QQ", view, 8)
+            table = struct.unpack_from(f"<{buffer_no * 2}Q", view, 24)
+            start = 24 + 16 * buffer_no
+            buffers = [view[offset: offset + size] for offset, size in zip(table[0::2], table[1::2])]
+            return pkl.loads(view[start: start + pickle_size], buffers=buffers)
+        return CompressedCacher._load(file_path)
+
+    def save(self, obj: Any):
+        folder = self.file_path.parent
+        if not folder.exists():
+            folder.mkdir(parents=True, exist_ok=True)
+        numpy = sys.modules.get("numpy")  # obj can only be an ndarray if numpy is already imported
+        if numpy is not None and type(obj) is numpy.ndarray and not obj.dtype.hasobject:
+            with _atomic_path(self.file_path.with_suffix(".npy")) as temp_path, open(temp_path, 'wb') as fp:
+                numpy.save(fp, obj, allow_pickle=False)
+            self._saved(self.file_path.with_suffix(".npy"))
+            return
+        buffers: List[pkl.PickleBuffer] = list()
+        payload = pkl.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        raws = [buffer.raw() for buffer in buffers]
+        table = list()
+        offset = 24 + 16 * len(raws) + len(payload)
+        for raw in raws:
+            offset += -offset % _NPK_ALIGN
+            table.extend((offset, raw.nbytes))
+            offset += raw.nbytes
+        with _atomic_path(self.file_path.with_suffix(".npk")) as temp_path, open(temp_path, 'wb') as fp:
+            fp.write(_NPK_MAGIC + struct.pack(f"<QQ{len(table)}Q", len(payload), len(raws), *table))
+            fp.write(payload)
+            for raw, offset in zip(raws, table[0::2]):
+                fp.write(b"\0" * (offset - fp.tell()))
+                fp.write(raw)
+        self._saved(self.file_path.with_suffix(".npk"))
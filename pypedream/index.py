@@ -0,0 +1,82 @@
+"""Per-stage index of cache files, so staleness checks and loads don't glob and stat the stage folder.
+Rebuild the index of folders populated out-of-band with
+    python -m pypedream.index rebuild <stage folder> [<stage folder> ...]
+"""
+from typing import Dict, Optional, Tuple
+from collections import namedtuple
+from argparse import ArgumentParser
+from pathlib import Path
+from os import getpid
+import sqlite3
+
+INDEX_NAME = ".index.sqlite"
+
+class IndexEntry(namedtuple("IndexEntry", ["file", "mtime", "size", "format"])):
+    """Current cache file of one case, as a file name relative to the stage folder."""
+    pass
+
+class CacheIndex(object):
+    """SQLite table mapping each case of a stage to its current cache file, mtime, size and format.
+    Cachers write it on every save when created with `index=True`, and answer `time()`/`load()` from it.
+    Connections are opened lazily and kept per process."""
+    _connections: Dict[Tuple[int, Path], sqlite3.Connection] = dict()
+
+    def __init__(self, folder: Path):
+        self.folder = folder
+        self.path = folder.joinpath(INDEX_NAME)
+
+    def _connect(self, create: bool = False) -> Optional[sqlite3.Connection]:
+        key = (getpid(), self.path)
+        connection = self._connections.get(key)
+        if connection is None:
+            if not create and not self.path.exists():
+                return None
+            self.folder.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(str(self.path), timeout=60, isolation_level=None)
+            connection.execute("CREATE TABLE IF NOT EXISTS entries "
+                               "(name TEXT PRIMARY KEY, file TEXT, mtime REAL, size INTEGER, format TEXT)")
+            self._connections[key] = connection
+        return connection
+
+    def get(self, name: str) -> Optional[IndexEntry]:
+        connection = self._connect()
+        if connection is None:
+            return None
+        row = connection.execute("SELECT file, mtime, size, format FROM entries WHERE name = ?", (name, )).fetchone()
+        return None if row is None else IndexEntry(*row)
+
+    def put(self, name: str, file_path: Path) -> IndexEntry:
+        """Record `file_path` as the current cache of case `name`."""
+        stat = file_path.stat()
+        entry = IndexEntry(file_path.name, stat.st_mtime, stat.st_size, file_path.suffix.lstrip("."))
+        self._connect(create=True).execute(  # type: ignore
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", (name, ) + tuple(entry))
+        return entry
+
+    def rebuild(self) -> int:
+        """Re-scan the stage folder and replace every entry with its most recent file. Returns the case count."""
+        recent: Dict[str, Tuple[float, Path]] = dict()
+        for entry in self.folder.iterdir():
+            if entry.name.startswith(".") or not entry.is_file() or entry.suffix == "":
+                continue
+            mtime = entry.stat().st_mtime
+            if entry.stem not in recent or recent[entry.stem][0] < mtime:
+                recent[entry.stem] = (mtime, entry)
+        connection = self._connect(create=True)
+        with connection:  # type: ignore
+            connection.execute("BEGIN")  # type: ignore
+            connection.execute("DELETE FROM entries")  # type: ignore
+            for name, (_, file_path) in recent.items():
+                self.put(name, file_path)
+        return len(recent)
+
+def main():
+    parser = ArgumentParser(description="Maintain per-stage cache indices.")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("folders", type=Path, nargs="+", help="stage folders, i.e. Task.path()")
+    args = parser.parse_args()
+    for folder in args.folders:
+        print(f"{folder}: {CacheIndex(folder.resolve()).rebuild()} cases")
+
+if __name__ == '__main__':
+    main()
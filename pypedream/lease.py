@@ -0,0 +1,114 @@
+"""Lease files that keep two processes, possibly on different machines sharing the cache folder, from computing
+the same (stage, case) at once. A lease is a file created with O_EXCL whose mtime its holder renews; a lease not
+renewed for `ttl` seconds belongs to a dead holder and is taken over by the next process waiting for it. Holding a
+lease is exclusive as long as every holder renews it within `ttl`, which is the assumption of any lease.
+"""
+from typing import Optional
+from pathlib import Path
+from threading import Event, Thread
+from time import sleep, time
+from uuid import uuid4
+import os
+import socket
+
+LEASE_FOLDER = ".leases"
+
+class Lease(object):
+    """Exclusive lease on case `name` of the stage folder `folder`, held inside a `with` block.
+    Args:
+        ttl: seconds after the last renewal from which the lease counts as abandoned. The holder renews it every
+            `ttl / 4` seconds from a thread, so `ttl` only bounds how long a crashed holder blocks others.
+        poll: seconds between attempts while another process holds the lease.
+    """
+    def __init__(self, folder: Path, name: str, ttl: float = 60., poll: Optional[float] = None):
+        self.path = folder.joinpath(LEASE_FOLDER, name)
+        self.ttl = ttl
+        self.poll = poll if poll is not None else min(1., ttl / 10)
+        self.token = f"{socket.gethostname()} {os.getpid()} {uuid4().hex}"
+        self.waited = False
+        self._stop = Event()
+        self._renewer: Optional[Thread] = None
+
+    def acquire(self):
+        """Blocks until the lease is held. `waited` tells whether another process held it meanwhile."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        while not self._create():
+            self.waited = True
+            if self._take_expired():
+                break
+            sleep(self.poll)
+        self._stop.clear()
+        self._renewer = Thread(target=self._renew, daemon=True)
+        self._renewer.start()
+
+    def release(self):
+        self._stop.set()
+        if self._renewer is not None:
+            self._renewer.join()
+            self._renewer = None
+        if self._owner() == self.token:
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self) -> "Lease":
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def _create(self) -> bool:
+        try:
+            fd = os.open(str(self.path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(self.token)
+        return True
+
+    def _owner(self) -> Optional[str]:
+        try:
+            return self.path.read_text()
+        except FileNotFoundError:
+            return None
+
+    def _take_expired(self) -> bool:
+        """Takes over an expired lease by renaming a file holding this token over it, so the lease path never goes
+        missing for another process to create in between. Waiting processes take turns through a `.breaking`
+        file, so no two of them take over the same lease."""
+        if not self._expired(self.path):
+            return False
+        breaking = self.path.with_name(f".{self.path.name}.breaking")
+        try:
+            os.close(os.open(str(breaking), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            if self._expired(breaking):  # left by a process that died while taking over
+                try:
+                    breaking.unlink()
+                except FileNotFoundError:
+                    pass
+            return False
+        try:
+            if not self._expired(self.path):  # released, renewed or taken over meanwhile
+                return False
+            claim = self.path.with_name(f".{self.path.name}.{uuid4().hex}")
+            claim.write_text(self.token)
+            os.replace(str(claim), str(self.path))
+            return True
+        finally:
+            breaking.unlink()
+
+    def _expired(self, path: Path) -> bool:
+        try:
+            return time() - path.stat().st_mtime >= self.ttl
+        except FileNotFoundError:
+            return False
+
+    def _renew(self):
+        while not self._stop.wait(self.ttl / 4):
+            try:
+                os.utime(str(self.path))
+            except FileNotFoundError:
+                return
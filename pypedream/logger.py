@@ -1,18 +1,131 @@
-from pkg_resources import Requirement, resource_string
+import atexit
+import copy
+import functools
+import importlib.resources
 import json
-from typing import Optional
+import os
+import weakref
+from typing import Dict, List, Optional, Tuple, Union
 from logging import Logger
+from logging.handlers import QueueHandler, QueueListener
 import logging.config
-import multiprocessing_logging
+import multiprocessing as mp
+from multiprocessing.util import Finalize
 
 __pkg__ = "pypedream"
+MODES = ("mp", "queue", "worker")
+BUFFER_SIZE = 1 << 16  # bytes of log lines a worker holds before writing them in "worker" mode
 
-def getLogger(log_name: str = "", log_path: Optional[str] = None) -> Logger:
-    config_str = resource_string(Requirement.parse(__pkg__), f"{__pkg__}/logger-conf.json")
-    config = json.loads(config_str)
+_configured: Dict[Tuple, Logger] = dict()
+_listeners: List[QueueListener] = list()
+_worker_handlers: "weakref.WeakSet[WorkerFileHandler]" = weakref.WeakSet()
+
+@functools.lru_cache(maxsize=None)
+def _config() -> dict:
+    return json.loads(importlib.resources.files(__pkg__).joinpath("logger-conf.json").read_text())
+
+def _flush(stream):
+    if not stream.closed:
+        stream.flush()
+
+class WorkerFileHandler(logging.FileHandler):
+    """Each process appends to its own `<stem>.<pid><suffix>` file through a `BUFFER_SIZE` buffer, so workers
+    never contend for a lock or a queue. The buffer is written when full, on warnings and errors, before a fork and
+    when the process exits."""
+    def __init__(self, filename: str, mode: str = 'a', encoding: Optional[str] = None):
+        self.base_path = os.path.abspath(filename)
+        self._pid = os.getpid()
+        super(WorkerFileHandler, self).__init__(self._worker_path(), mode, encoding, delay=True)
+        _worker_handlers.add(self)
+
+    def _worker_path(self) -> str:
+        stem, suffix = os.path.splitext(self.base_path)
+        return f"{stem}.{self._pid}{suffix}"
+
+    def _open(self):
+        stream = open(self.baseFilename, self.mode, buffering=BUFFER_SIZE, encoding=self.encoding)
+        # workers leave through os._exit, which skips logging.shutdown
+        Finalize(self, _flush, args=(stream, ), exitpriority=10)
+        return stream
+
+    def emit(self, record: logging.LogRecord):
+        if os.getpid() != self._pid:  # forked, the inherited stream belongs to the parent
+            self._pid = os.getpid()
+            self.stream = None
+            self.baseFilename = self._worker_path()
+            self.mode = 'a'
+        super(WorkerFileHandler, self).emit(record)
+        if record.levelno >= logging.WARNING:
+            self.stream.flush()
+
+    def flush(self):
+        """Called after every record, the buffer is written by `emit` instead."""
+
+    def close(self):
+        if self.stream is not None:
+            _flush(self.stream)
+        super(WorkerFileHandler, self).close()
+
+def _flush_workers():
+    for handler in list(_worker_handlers):
+        if handler.stream is not None:
+            _flush(handler.stream)
+
+if hasattr(os, "register_at_fork"):
+    # a forked worker would otherwise write out the lines buffered by its parent a second time
+    os.register_at_fork(before=_flush_workers)
+
+def _queue(root: Logger):
+    """Moves the handlers of `root` to a listener thread of this process, fed by a queue that forked workers
+    inherit. Only records that some handler would emit are sent."""
+    handlers = list(root.handlers)
+    queue = mp.Queue(-1)
+    listener = QueueListener(queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    handler = QueueHandler(queue)
+    handler.setLevel(min(h.level for h in handlers) if handlers else logging.NOTSET)
+    for h in handlers:
+        root.removeHandler(h)
+    root.addHandler(handler)
+
+def _stop_listeners():
+    while _listeners:
+        _listeners.pop().stop()
+
+atexit.register(_stop_listeners)
+
+def getLogger(log_name: str = "", log_path: Optional[str] = None, level: Optional[Union[int, str]] = None,
+              mode: str = "mp") -> Logger:
+    """Logger writing INFO and above to the console and everything to `log_path`.
+    Args:
+        level: the lowest level logged, DEBUG by default. Calls below it return before formatting anything.
+        mode: how worker processes log. 'mp' wraps the handlers of the logger with `multiprocessing_logging`.
+            'queue' sends records from all processes to a `QueueListener` thread in this process.
+            'worker' has every process write its own buffered `<log_path stem>.<pid>.log` file.
+    Loggers are configured once per set of arguments, later calls return the same logger.
+    """
+    assert mode in MODES, f"mode must be one of {MODES}"
+    key = (log_name, log_path, level, mode)
+    logger = _configured.get(key)
+    if logger is not None:
+        return logger
+    _stop_listeners()
+    config = copy.deepcopy(_config())
     if log_path is not None:
         config["handlers"]["file"]["filename"] = log_path
+    if level is not None:
+        config["root"]["level"] = level
+    if mode == "worker":
+        config["handlers"]["file"]["class"] = f"{__name__}.WorkerFileHandler"
+        config["handlers"]["file"]["mode"] = 'a'
     logging.config.dictConfig(config)
     logger = logging.getLogger(log_name)
-    multiprocessing_logging.install_mp_handler(logger)
+    if mode == "mp":
+        import multiprocessing_logging
+        multiprocessing_logging.install_mp_handler(logger)
+    elif mode == "queue":
+        _queue(logging.getLogger())
+    _configured.clear()  # dictConfig replaced the handlers of previous configurations
+    _configured[key] = logger
     return logger
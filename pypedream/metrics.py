@@ -0,0 +1,122 @@
+"""Per-stage metrics of Task runs: wall time and count of staleness checks, loads, computes and saves, and the
+cache bytes read and written. Cache hits are the loads of a Task, misses its computes. Every process records into
+its own `Metrics`; workers of `Executor` and `Scheduler` send theirs back with each job, so the parent holds the
+totals of a run. `get_result` logs them and can write them as JSON or Prometheus text.
+"""
+from typing import Dict, Iterator, List, Optional
+from contextlib import contextmanager
+from threading import Lock, local
+from time import perf_counter
+import json
+import os
+
+KINDS = ("check", "load", "compute", "save")
+
+class _Timing(object):
+    __slots__ = ("seconds", "nbytes")
+
+    def __init__(self):
+        self.seconds = 0.
+        self.nbytes: Optional[int] = None
+
+class Metrics(object):
+    """Counters by stage and kind, each a [count, seconds, bytes] list."""
+    def __init__(self, stages: Optional[Dict[str, Dict[str, List[float]]]] = None):
+        self.stages: Dict[str, Dict[str, List[float]]] = stages if stages is not None else dict()
+        self._lock = Lock()
+        self._local = local()
+
+    def __getstate__(self):
+        return {"stages": self.stages}
+
+    def __setstate__(self, state):
+        self.__init__(state["stages"])
+
+    def add(self, stage: str, kind: str, seconds: float = 0., count: int = 1, nbytes: int = 0):
+        with self._lock:
+            counter = self.stages.setdefault(stage, dict()).setdefault(kind, [0, 0., 0])
+            counter[0] += count
+            counter[1] += seconds
+            counter[2] += nbytes
+
+    @contextmanager
+    def timer(self, stage: str, kind: str) -> Iterator[_Timing]:
+        """Times the block, leaving out the time of timers nested in it, which count for their own stage.
+        Set `nbytes` of the yielded timing to record bytes read or written."""
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = list()
+        timing = _Timing()
+        stack.append(0.)
+        start = perf_counter()
+        try:
+            yield timing
+        finally:
+            elapsed = perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            timing.seconds = elapsed - nested
+            self.add(stage, kind, timing.seconds, nbytes=timing.nbytes or 0)
+
+    def merge(self, other: "Metrics"):
+        for stage, kinds in other.stages.items():
+            for kind, (count, seconds, nbytes) in kinds.items():
+                self.add(stage, kind, seconds, count, nbytes)
+
+    def take(self) -> "Metrics":
+        """The metrics recorded so far, after which this object starts from zero."""
+        with self._lock:
+            stages, self.stages = self.stages, dict()
+        return Metrics(stages)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Per stage: `hits`, `misses`, `hit_rate` and `<kind>_count`, `<kind>_seconds`, `<kind>_bytes` per kind."""
+        summary = dict()
+        for stage, kinds in sorted(self.stages.items()):
+            row = {"hits": kinds.get("load", [0])[0], "misses": kinds.get("compute", [0])[0]}
+            row["hit_rate"] = row["hits"] / (row["hits"] + row["misses"]) if row["hits"] + row["misses"] else None
+            for kind in KINDS:
+                count, seconds, nbytes = kinds.get(kind, (0, 0., 0))
+                row.update({kind + "_count": count, kind + "_seconds": seconds, kind + "_bytes": nbytes})
+            summary[stage] = row
+        return summary
+
+    def report(self) -> str:
+        lines = list()
+        for stage, row in self.summary().items():
+            rate = "" if row["hit_rate"] is None else f" ({row['hit_rate']:.0%} hits)"
+            times = ", ".join(f"{kind} {row[kind + '_seconds']:.3f}s" for kind in KINDS if row[kind + "_count"])
+            io = f", read {row['load_bytes']} B, written {row['save_bytes']} B" \
+                if row["load_bytes"] or row["save_bytes"] else ""
+            lines.append(f"{stage}: {row['hits']} hits / {row['misses']} misses{rate}, {times}{io}")
+        return "\n".join(lines)
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition of the counters."""
+        lines = list()
+        for metric, index, help_text in (("pypedream_calls_total", 0, "Number of calls."),
+                                         ("pypedream_seconds_total", 1, "Wall time spent, in seconds."),
+                                         ("pypedream_bytes_total", 2, "Cache bytes read by loads, written by saves.")):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            for stage, kinds in sorted(self.stages.items()):
+                for kind, counter in sorted(kinds.items()):
+                    lines.append(f'{metric}{{stage="{_escape(stage)}",kind="{kind}"}} {counter[index]}')
+        return "\n".join(lines) + "\n"
+
+    def save(self, path: str):
+        """Writes the summary as JSON, or the counters as Prometheus text if `path` ends with .prom or .txt."""
+        with open(path, 'w') as fp:
+            if str(path).endswith((".prom", ".txt")):
+                fp.write(self.to_prometheus())
+            else:
+                json.dump(self.summary(), fp, indent=2)
+
+def _escape(label: str) -> str:
+    return label.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+metrics = Metrics()  # of this process
+
+if hasattr(os, "register_at_fork"):
+    # a forked worker must not send back what its parent recorded before the fork
+    os.register_at_fork(after_in_child=lambda: metrics.__init__())
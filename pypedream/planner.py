@@ -0,0 +1,110 @@
+"""Dry-run planning: which (stage, case) pairs are stale, why, and how long rebuilding them should take.
+No stage function is run. From the command line:
+    python -m pypedream.planner my_project.pipeline:output_task --cases cases.txt --output plan.csv
+"""
+from typing import Any, Dict, List, Optional, Union
+from argparse import ArgumentParser
+from importlib import import_module
+from logging import Logger
+from multiprocessing import Pool, cpu_count
+from statistics import mean
+import csv
+import logging
+import sys
+from .task import TaskMixin, Task, CaseContext, prefetch
+
+COLUMNS = ["stage", "case", "stale", "reason", "projected"]
+
+def _plan_cases(job: tuple) -> List[Dict[str, Any]]:
+    cases, tasks, costs, logger = job
+    rows = list()
+    loaders = prefetch(cases, tasks)
+    # every stage, as a stage found stale by hash returns without resolving its dependencies
+    stages = list(_stages(tasks).values())
+    for case in cases:
+        context = CaseContext(case, logger, dry=True, loaders=loaders)
+        for task in tasks + stages:
+            context.resolve(task)
+        for node, state in context.states.items():
+            if isinstance(node, Task):
+                rows.append({"stage": node.__name__, "case": case, "stale": state.stale, "reason": state.reason,
+                             "projected": costs.get(node.__name__) if state.stale else 0.})
+    return rows
+
+def _stages(tasks: List[TaskMixin]) -> Dict[str, Task]:
+    stages: Dict[str, Task] = dict()
+    stack = list(tasks)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Task) and node.__name__ not in stages:
+            stages[node.__name__] = node
+            stack.extend(node.dependencies or tuple())
+    return stages
+
+def plan(cases: list, tasks: Union[TaskMixin, List[TaskMixin]], workers: Optional[int] = None,
+         logger: Optional[Logger] = None, as_frame: bool = True) -> Any:
+    """Evaluate staleness of every stage of `tasks` for all `cases` in parallel, without running any stage.
+    Returns one row per (stage, case) with columns `stage`, `case`, `stale`, `reason` ('self', 'dependency',
+    'dependency-newer', 'missing' or '' when fresh) and `projected`, the mean of the stage's recorded run times
+    for stale rows (None without history). A pandas DataFrame if pandas is installed and `as_frame`, else a list
+    of dicts."""
+    tasks = [tasks] if isinstance(tasks, TaskMixin) else list(tasks)
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    workers = workers if workers is not None else max(1, cpu_count() - 3)
+    costs = {name: mean(history) for name, history in ((name, stage.durations())
+                                                         for name, stage in _stages(tasks).items()) if history}
+    # chunks balance the load of several workers, each looks up its inputs in bulk
+    chunk = max(1, len(cases) // (workers * 4)) if workers > 1 else max(1, len(cases))
+    jobs = [(cases[start: start + chunk], tasks, costs, logger) for start in range(0, len(cases), chunk)]
+    if workers == 1:
+        chunks = [_plan_cases(job) for job in jobs]
+    else:
+        with Pool(workers) as pool:
+            chunks = pool.map(_plan_cases, jobs)
+    rows = [row for rows in chunks for row in rows]
+    if as_frame:
+        try:
+            import pandas as pd
+            return pd.DataFrame(rows, columns=COLUMNS)
+        except ImportError:
+            pass
+    return rows
+
+def summarize(rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Per stage: total and stale counts, stale counts per reason and projected seconds."""
+    summary: Dict[str, Dict[str, Any]] = dict()
+    for row in rows:
+        stage = summary.setdefault(row["stage"], {"cases": 0, "stale": 0, "reasons": dict(), "projected": 0.})
+        stage["cases"] += 1
+        if row["stale"]:
+            stage["stale"] += 1
+            stage["reasons"][row["reason"]] = stage["reasons"].get(row["reason"], 0) + 1
+            if stage["projected"] is not None:
+                stage["projected"] = None if row["projected"] is None else stage["projected"] + row["projected"]
+    return summary
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("tasks", help="module:attribute of an output Task or list of Tasks")
+    parser.add_argument("--cases", required=True, help="text file with one case name per line")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=None, help="write the full table to this csv file")
+    args = parser.parse_args()
+    sys.path.insert(0, "")
+    module, attribute = args.tasks.split(":")
+    tasks = getattr(import_module(module), attribute)
+    with open(args.cases) as fp:
+        cases = [line.strip() for line in fp if line.strip()]
+    rows = plan(cases, tasks, workers=args.workers, as_frame=False)
+    if args.output is not None:
+        with open(args.output, 'w', newline='') as fp:
+            writer = csv.DictWriter(fp, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    for name, stage in summarize(rows).items():
+        projected = "unknown" if stage["projected"] is None else f"{stage['projected']:.1f}s"
+        reasons = ", ".join(f"{reason}: {count}" for reason, count in stage["reasons"].items())
+        print(f"{name}: {stage['stale']}/{stage['cases']} stale ({reasons}), projected {projected}")
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,36 @@
-from typing import Callable, Tuple, Set, Dict
+from typing import Callable, Tuple, Set, Dict, List
 import functools
+import logging
 from enum import Enum
 from collections import namedtuple
 import sys
 import traceback
+import threading
 import multiprocessing as mp
-from multiprocessing.managers import Namespace
-from queue import Full, Empty
+import pickle
+import weakref
+from multiprocessing.reduction import ForkingPickler
+from multiprocessing.synchronize import Event
+from queue import Empty, Queue
+from time import monotonic, sleep
+from .task import CaseContext, TaskMixin
+try:
+    import numpy as np
+    from multiprocessing import resource_tracker
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:
+    np = None
 
-_MANAGER = mp.Manager()
+POLL_TIMEOUT = 0.1  # seconds between checks of the pipeline error flag by a consumer
+DEFAULT_BUDGET = 10000  # queue messages a pipeline may hold in total, see `to_iterable`
+UNBOUNDED = -1  # maxsize of a stage whose input queue is never bounded, neither by `maxsize` nor by the budget
 
 class _QueueStatus(Enum):
     DONE = 1
     CONTINUE = 2
     TIMEOUT = 3
     UNDEFINED = 4
+    STOP = 5
 
 class _QueueItem(object):
     def __eq__(self, other):
@@ -23,22 +39,76 @@ class _QueueItem(object):
         else:
             return super(_QueueItem, self).__eq__(other)
 
-    def __hash__(self):
-        if isinstance(self, _QueueStatus):
-            return hash(self._name_)
-        return hash((self.args[0], self.target))
+    __hash__ = object.__hash__
 
-def _get_namespace():
-    return _MANAGER.Namespace()
+class _Batch(list):
+    """Several items sent through a stage queue as one message."""
+
+class _SharedArray(object):
+    """Handle of a numpy array copied into a shared memory block, which is all that goes through the queue."""
+    def __init__(self, x):
+        shm = SharedMemory(create=True, size=max(1, x.nbytes))
+        np.ndarray(x.shape, x.dtype, buffer=shm.buf)[...] = x
+        shm.close()
+        self.name, self.shape, self.dtype = shm.name, x.shape, x.dtype
+
+    def load(self):
+        """The array, backed by the block without a copy. The block is unlinked at once, so its memory is freed
+        when the array is."""
+        shm = SharedMemory(self.name)
+        shm.unlink()
+        x = np.ndarray(self.shape, self.dtype, buffer=shm.buf)
+        # views of `x` keep it alive, so the mapping is closed once no array uses it
+        weakref.finalize(x, shm.close)
+        return x
+
+    def free(self):
+        shm = SharedMemory(self.name)
+        shm.unlink()
+        shm.close()
+
+def _share(x, threshold):
+    """`x` with every numpy array of at least `threshold` bytes, in lists, tuples and dict values, replaced by a
+    `_SharedArray`. Returns `x` itself if nothing was replaced."""
+    if type(x) is np.ndarray:
+        return _SharedArray(x) if x.nbytes >= threshold and not x.dtype.hasobject else x
+    elif type(x) in (list, tuple, _Batch):
+        items = [_share(y, threshold) for y in x]
+        return type(x)(items) if any(y is not z for y, z in zip(items, x)) else x
+    elif type(x) is dict:
+        items = {key: _share(y, threshold) for key, y in x.items()}
+        return items if any(items[key] is not y for key, y in x.items()) else x
+    return x
+
+def _unshare(x, f):
+    if type(x) is _SharedArray:
+        return f(x)
+    elif type(x) in (list, tuple, _Batch):
+        return type(x)(_unshare(y, f) for y in x)
+    elif type(x) is dict:
+        return {key: _unshare(y, f) for key, y in x.items()}
+    return x
+
+class _Shared(object):
+    """A queue message holding `_SharedArray` handles."""
+    def __init__(self, payload):
+        self.payload = payload
+
+    def load(self):
+        return _unshare(self.payload, _SharedArray.load)
+
+    def free(self):
+        _unshare(self.payload, _SharedArray.free)
 
 class _Stage(_QueueItem):
-    def __init__(self, worker_constructor, workers, maxsize, target, args, dependencies):
+    def __init__(self, worker_constructor, workers, maxsize, target, args, dependencies, chunksize=1):
         self.worker_constructor = worker_constructor
         self.workers = workers
         self.maxsize = maxsize
         self.target = target
         self.args = args
         self.dependencies = dependencies
+        self.chunksize = chunksize
 
     def __iter__(self):
         return to_iterable(self)
@@ -48,13 +118,14 @@ class _Stage(_QueueItem):
 
     def __repr__(self):
         return ("_Stage(worker_constructor = {worker_constructor}, workers = {workers}, maxsize = {maxsize},"
-                "target = {target}, args = {args}, dependencies = {dependencies})".format(
+                "target = {target}, args = {args}, dependencies = {dependencies}, chunksize = {chunksize})".format(
                     worker_constructor=self.worker_constructor,
                     workers=self.workers,
                     maxsize=self.maxsize,
                     target=self.target,
                     args=self.args,
                     dependencies=len(self.dependencies),
+                    chunksize=self.chunksize,
                 ))
 
 class Partial(_QueueItem):
@@ -74,9 +145,10 @@ class _StageParams(
         namedtuple("_StageParams", [
             "input_queue",
             "output_queues",
-            "pipeline_namespace",
+            "pipeline_error",
             "pipeline_error_queue",
             "index",
+            "stage_status",
         ])):
     pass
 
@@ -84,23 +156,25 @@ WorkerInfo = namedtuple("WorkerInfo", ["index"])
 
 class StageStatus(object):
     """Object passed to various `on_done` callbacks. It contains information about the stage in case book
-    keeping is needed.
+    keeping is needed. The worker count lives in shared memory, so it is valid in every worker of the stage.
     """
-    def __init__(self, namespace, lock):
-        self._namespace = namespace
-        self._lock = lock
+    def __init__(self, workers):
+        self._active_workers = mp.Value('i', workers)
+
+    def _worker_done(self):
+        with self._active_workers.get_lock():
+            self._active_workers.value -= 1
 
     @property
     def done(self) -> bool:
         """If all workers finished."""
-        with self._lock:
-            return self._namespace.active_workers == 0
+        return self.active_workers == 0
 
     @property
     def active_workers(self) -> int:
         """Number of active workers."""
-        with self._lock:
-            return self._namespace.active_workers
+        with self._active_workers.get_lock():
+            return self._active_workers.value
 
     def __str__(self):
         return "StageStatus(done = {done}, active_workers = {active_workers})".format(
@@ -109,35 +183,63 @@ class StageStatus(object):
         )
 
 class _InputQueue(object):
-    def __init__(self, maxsize, total_done, pipeline_namespace, **kwargs):
-        self.queue: mp.Queue = mp.Queue(maxsize=maxsize, **kwargs)
-        self.lock = mp.Lock()
-        self.namespace = _MANAGER.Namespace()
-        self.namespace.remaining = total_done
-        self.pipeline_namespace = pipeline_namespace
+    """Queue shared by the `consumers` workers of a stage. Consumers block on it until data arrives. Whoever takes
+    the last of the `total_done` DONE sentinels (one per upstream worker) wakes the other consumers with STOP.
+    The DONE count lives in shared memory and the pipeline error flag is checked at most every `POLL_TIMEOUT`,
+    so passing an item costs no round trip to another process. A `local` queue only links threads of this
+    process and passes items without pickling them."""
+    def __init__(self, maxsize, total_done, pipeline_error: Event, consumers=1, local=False, **kwargs):
+        self.maxsize = maxsize or 0
+        self.local = local
+        self.queue = Queue(maxsize=self.maxsize) if local else mp.Queue(maxsize=self.maxsize, **kwargs)
+        self.remaining = mp.Value('i', total_done)
+        self.pipeline_error = pipeline_error
+        self.consumers = consumers
 
     def __iter__(self):
-        while not self.is_done():
+        return self.items()
+
+    def items(self, flush=None):
+        """Yields the items of the queue, unpacking batches. `flush` is called before waiting on an empty queue,
+        so that a consumer that batches its own output never holds items back while it is starved."""
+        checked = monotonic()
+        while True:
+            if flush is not None and self.queue.empty():
+                flush()
             x = self.get()
-            if self.pipeline_namespace.error:
+            if x is _QueueStatus.DONE:
                 return
-            if x != _QueueStatus.CONTINUE:
+            now = monotonic()
+            if now - checked > POLL_TIMEOUT or x is _QueueStatus.TIMEOUT:
+                if self.pipeline_error.is_set():
+                    return
+                checked = now
+            if isinstance(x, _Shared):
+                x = x.load()
+            if isinstance(x, _Batch):
+                yield from x
+            elif not isinstance(x, _QueueStatus):
                 yield x
 
     def get(self):
+        """Block until the next item. Returns TIMEOUT after `POLL_TIMEOUT`, CONTINUE for a DONE sentinel
+        from one upstream worker and DONE once every upstream worker is done."""
         try:
-            x = self.queue.get(block=False)
-        except (Empty, Full):
-            return _QueueStatus.CONTINUE
-        if x != _QueueStatus.DONE:
+            x = self.queue.get(timeout=POLL_TIMEOUT)
+        except Empty:
+            return _QueueStatus.TIMEOUT
+        if not isinstance(x, _QueueStatus):
             return x
-        else:
-            with self.lock:
-                self.namespace.remaining -= 1
+        if x is _QueueStatus.STOP:
+            return _QueueStatus.DONE
+        with self.remaining.get_lock():
+            self.remaining.value -= 1
+            remaining = self.remaining.value
+        if remaining > 0:
             return _QueueStatus.CONTINUE
-
-    def is_done(self):
-        return self.namespace.remaining == 0 and self.queue.empty()
+        for _ in range(self.consumers - 1):
+            self.queue.put(_QueueStatus.STOP)
+        return _QueueStatus.DONE
 
     def put(self, x):
         self.queue.put(x)
@@ -145,15 +247,68 @@ class _InputQueue(object):
     def done(self):
         self.queue.put(_QueueStatus.DONE)
 
+    def drain(self):
+        """Drops the waiting messages, so that producers blocked on a full queue can go on."""
+        try:
+            while True:
+                x = self.queue.get_nowait()
+                if isinstance(x, _Shared):
+                    x.free()
+        except Empty:
+            pass
+
+    def qsize(self):
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:  # macOS has no sem_getvalue
+            return None
+
 class _OutputQueueList(list):
+    """The input queues of the stages downstream of a stage. With `chunksize > 1` each worker collects its output
+    in a `_Batch` that is sent once full, when the worker waits for input and when the worker is done. With
+    `shared_memory` set, numpy arrays of at least that many bytes go to other processes through shared memory,
+    a block per queue."""
+    def __init__(self, queues=(), chunksize=1, shared_memory=None):
+        super(_OutputQueueList, self).__init__(queues)
+        self.chunksize = chunksize
+        self.shared_memory = shared_memory
+        self.pending = _Batch()
+
     def put(self, x):
+        if self.chunksize == 1:
+            self._send(x)
+            return
+        self.pending.append(x)
+        if len(self.pending) >= self.chunksize:
+            self.flush()
+
+    def _send(self, x):
         for queue in self:
-            queue.put(x)
+            if self.shared_memory is None or queue.local or np is None:
+                queue.put(x)
+                continue
+            shared = _share(x, self.shared_memory)
+            queue.put(x if shared is x else _Shared(shared))
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        batch, self.pending = self.pending, _Batch()
+        self._send(batch)
 
     def done(self):
+        self.flush()
         for queue in self:
             queue.put(_QueueStatus.DONE)
 
+def _items(params):
+    flush = params.output_queues.flush if params.output_queues.chunksize > 1 else None
+    return params.input_queue.items(flush)
+
+def _report_exception(params, e):
+    params.pipeline_error_queue.put((type(e), e, "".join(traceback.format_exception(*sys.exc_info()))))
+    params.pipeline_error.set()
+
 def _handle_exceptions(params):
     def handle_exceptions(f):
         @functools.wraps(f)
@@ -161,30 +316,100 @@ def _handle_exceptions(params):
             try:
                 return f(*args, **kwargs)
             except BaseException as e:
-                params.pipeline_error_queue.put((type(e), e, "".join(traceback.format_exception(*sys.exc_info()))))
-                params.pipeline_namespace.error = True
+                _report_exception(params, e)
         return wrapper
     return handle_exceptions
 
-def _run_task(f_task, params):
-    if params.input_queue:
-        for x in params.input_queue:
-            f_task(x)
-    else:
-        f_task()
+def _as_args(args) -> tuple:
+    if args is None:
+        return ()
+    return args if isinstance(args, tuple) else (args, )
+
+def _start_worker(on_start):
+    return _as_args(on_start()) if on_start is not None else ()
+
+def _stop_worker(on_done, args, params):
+    params.stage_status._worker_done()
+    if on_done is not None:
+        on_done(params.stage_status, *args)
+
+def _run_task(f_task, params, on_start=None, on_done=None):
+    """Calls `f_task(x, *args)` for every input item, or `f_task(*args)` once for a source stage, where `args` is
+    what `on_start` returned for this worker."""
+    args = _handle_exceptions(params)(_start_worker)(on_start)
+    if args is not None:
+        if params.input_queue:
+            for x in _items(params):
+                f_task(x, *args)
+        else:
+            _handle_exceptions(params)(f_task)(*args)
+        _handle_exceptions(params)(_stop_worker)(on_done, args, params)
     params.output_queues.done()
 
-def _map(f, params):
+def _map(f, on_start, on_done, params):
     @_handle_exceptions(params)
-    def f_task(x):
-        y = f(x)
+    def f_task(x, *args):
+        y = f(x, *args)
         params.output_queues.put(y)
-    _run_task(f_task, params)
+    _run_task(f_task, params, on_start, on_done)
+
+def _tag(semaphore, params):
+    index = 0
+    for x in _items(params):
+        if not semaphore.acquire(block=False):
+            params.output_queues.flush()
+            while not semaphore.acquire(timeout=POLL_TIMEOUT):
+                if params.pipeline_error.is_set():
+                    return
+        params.output_queues.put((index, x))
+        index += 1
+    params.output_queues.done()
+
+def _map_tagged(f, on_start, on_done, params):
+    @_handle_exceptions(params)
+    def f_task(item, *args):
+        index, x = item
+        params.output_queues.put((index, True, f(x, *args)))
+    _run_task(f_task, params, on_start, on_done)
+
+def _filter_tagged(f, on_start, on_done, params):
+    @_handle_exceptions(params)
+    def f_task(item, *args):
+        index, x = item
+        params.output_queues.put((index, bool(f(x, *args)), x))
+    _run_task(f_task, params, on_start, on_done)
 
-def map(f, stage=_QueueStatus.UNDEFINED, workers=1, maxsize=0):
+def _reorder(semaphore, params):
+    buffer = dict()
+    expected = 0
+    for index, keep, y in _items(params):
+        buffer[index] = (keep, y)
+        while expected in buffer:
+            keep, y = buffer.pop(expected)
+            if keep:
+                params.output_queues.put(y)
+            semaphore.release()
+            expected += 1
+    params.output_queues.done()
+
+def _ordered_stage(target, args, stage, workers, maxsize, window, chunksize, worker_constructor=mp.Process):
+    """Wraps a `target` worker between a stage that numbers the input and one that puts the output back in that
+    order. At most `window` items are between the two, which bounds the reorder buffer."""
+    if window < 1:
+        raise ValueError("window must be at least 1, got {window}".format(window=window))
+    semaphore = mp.BoundedSemaphore(window)
+    tagged = _Stage(worker_constructor=worker_constructor, workers=1, maxsize=maxsize, target=_tag,
+                    args=(semaphore, ), dependencies=[stage], chunksize=chunksize)
+    mapped = _Stage(worker_constructor=worker_constructor, workers=workers, maxsize=maxsize, target=target,
+                    args=args, dependencies=[tagged], chunksize=chunksize)
+    return _Stage(worker_constructor=worker_constructor, workers=1, maxsize=0, target=_reorder,
+                  args=(semaphore, ), dependencies=[mapped], chunksize=chunksize)
+
+def map(f, stage=_QueueStatus.UNDEFINED, workers=1, maxsize=0, ordered=False, window=64, chunksize=1,
+        on_start=None, on_done=None, worker_constructor=mp.Process):
     """Creates a stage that maps a function `f` over the data. Its intended to behave like
     python's built-in `map` function but with the added concurrency.
-    Note that because of concurrency order is not guaranteed.
+    Note that because of concurrency order is not guaranteed unless `ordered` is set.
     Args:
         f: a function with signature `f(x, *args) -> y`, where `args` is the return of `on_start`
             if present, else the signature is just `f(x) -> y`.
@@ -192,39 +417,53 @@ def map(f, stage=_QueueStatus.UNDEFINED, workers=1, maxsize=0):
         workers: the number of workers the stage should contain.
         maxsize: the maximum number of objects the stage can hold simultaneously, if set to `0`
             (default) then the stage can grow unbounded.
+        ordered: if `True` results are yielded in input order, each as soon as all earlier ones are out.
+        window: with `ordered`, the maximum number of items in flight at once. A slow item holds back at most
+            `window - 1` finished ones.
+        chunksize: the number of results sent downstream as one queue message. Values above `1` cut the
+            pickling and locking cost per item when items are small. Also used for `stage` if it is an iterable.
         on_start: a function with signature `on_start() -> args`, where `args` can be any object
             different than `None` or a tuple of objects. The returned `args` are passed to `f` and `on_done`. This
             function is executed once per worker at the beggining.
         on_done: a function with signature `on_done(stage_status, *args)`, where `args` is the
             return of `on_start` if present, else the signature is just `on_done(stage_status)`, and `stage_status`
-            is of type `pypeln.process.StageStatus`. This function is executed once per worker when the worker is done.
+            is of type `pypedream.process.StageStatus`. This function is executed once per worker when the worker is
+            done.
+        worker_constructor: the worker type of the stage, `multiprocessing.Process` or `threading.Thread`.
     Returns:
         If the `stage` parameters is given then this function returns a new stage, else it returns a `Partial`.
     """
     if stage == _QueueStatus.UNDEFINED:
-        return Partial(lambda stage: map(f, stage, workers=workers, maxsize=maxsize))
-    stage = _to_stage(stage)
+        return Partial(lambda stage: map(f, stage, workers=workers, maxsize=maxsize, ordered=ordered, window=window,
+                                         chunksize=chunksize, on_start=on_start, on_done=on_done,
+                                         worker_constructor=worker_constructor))
+    stage = _to_stage(stage, chunksize, worker_constructor)
+    if ordered:
+        return _ordered_stage(_map_tagged, (f, on_start, on_done), stage, workers, maxsize, window, chunksize,
+                              worker_constructor)
     return _Stage(
-        worker_constructor=mp.Process,
+        worker_constructor=worker_constructor,
         workers=workers,
         maxsize=maxsize,
         target=_map,
-        args=(f, ),
+        args=(f, on_start, on_done),
         dependencies=[stage],
+        chunksize=chunksize,
     )
 
-def _filter(f, params):
+def _filter(f, on_start, on_done, params):
     @_handle_exceptions(params)
-    def f_task(x):
-        if f(x):
+    def f_task(x, *args):
+        if f(x, *args):
             params.output_queues.put(x)
-    _run_task(f_task, params)
+    _run_task(f_task, params, on_start, on_done)
 
-def filter(f, stage=_QueueStatus.UNDEFINED, workers=1, maxsize=0):
+def filter(f, stage=_QueueStatus.UNDEFINED, workers=1, maxsize=0, ordered=False, window=64, chunksize=1,
+           on_start=None, on_done=None, worker_constructor=mp.Process):
     """
     Creates a stage that filter the data given a predicate function `f`. It is intended to behave
     like python's built-in `filter` function but with the added concurrency.
-    Note that because of concurrency order is not guaranteed.
+    Note that because of concurrency order is not guaranteed unless `ordered` is set.
     Args:
         f: a function with signature `f(x, *args) -> bool`, where `args` is the return of `on_start`
             if present, else the signature is just `f(x)`.
@@ -232,26 +471,37 @@ def filter(f, stage=_QueueStatus.UNDEFINED, workers=1, maxsize=0):
         workers: the number of workers the stage should contain.
         maxsize: the maximum number of objects the stage can hold simultaneously, if set to 0
             then the stage can grow unbounded.
+        ordered: if `True` the kept items are yielded in input order.
+        window: with `ordered`, the maximum number of items in flight at once.
+        chunksize: the number of kept items sent downstream as one queue message. Also used for `stage` if it is
+            an iterable.
         on_start: a function with signature `on_start() -> args`, where `args` can be any object different
             than `None` or a tuple of objects. The returned `args` are passed to `f` and `on_done`.
             This function is executed once per worker at the beggining.
         on_done: a function with signature `on_done(stage_status, *args)`, where `args` is the return of
             `on_start` if present, else the signature is just `on_done(stage_status)`, and `stage_status`
-            is of type `pypeln.process.StageStatus`. This function is executed once per worker when the worker is done.
+            is of type `pypedream.process.StageStatus`. This function is executed once per worker when the worker is
+            done.
+        worker_constructor: the worker type of the stage, `multiprocessing.Process` or `threading.Thread`.
     Returns:
         If the `stage` parameters is given then this function returns a new stage, else it returns a `Partial`.
     """
     if stage == _QueueStatus.UNDEFINED:
-        return Partial(lambda stage: filter(
-            f, stage, workers=workers, maxsize=maxsize))
-    stage = _to_stage(stage)
+        return Partial(lambda stage: filter(f, stage, workers=workers, maxsize=maxsize, ordered=ordered,
+                                            window=window, chunksize=chunksize, on_start=on_start, on_done=on_done,
+                                            worker_constructor=worker_constructor))
+    stage = _to_stage(stage, chunksize, worker_constructor)
+    if ordered:
+        return _ordered_stage(_filter_tagged, (f, on_start, on_done), stage, workers, maxsize, window, chunksize,
+                              worker_constructor)
     return _Stage(
-        worker_constructor=mp.Process,
+        worker_constructor=worker_constructor,
         workers=workers,
         maxsize=maxsize,
         target=_filter,
-        args=(f, ),
+        args=(f, on_start, on_done),
         dependencies=[stage],
+        chunksize=chunksize,
     )
 
 def _concat(params):
@@ -260,79 +510,166 @@ def _concat(params):
         params.output_queues.put(x)
     _run_task(f_task, params)
 
-def concat(stages, maxsize=0):
+def concat(stages, maxsize=0, chunksize=1, worker_constructor=mp.Process):
     """Concatenates / merges many stages into a single one by appending elements from each stage as they come,
     order is not preserved.
     Args:
         stages: a list of stages or iterables.
         maxsize: the maximum number of objects the stage can hold simultaneously, if set to `0` (default) then the stage
             can grow unbounded.
+        chunksize: the number of items sent downstream as one queue message. Also used for the iterables in `stages`.
+        worker_constructor: the worker type of the stage, `multiprocessing.Process` or `threading.Thread`.
     Returns:
         A stage object.
     """
-    stages = [_to_stage(s) for s in stages]
+    stages = [_to_stage(s, chunksize, worker_constructor) for s in stages]
     return _Stage(
-        worker_constructor=mp.Process,
+        worker_constructor=worker_constructor,
         workers=1,
         maxsize=maxsize,
         target=_concat,
         args=tuple(),
         dependencies=stages,
+        chunksize=chunksize,
     )
 
-def _to_stage(obj):
+def _route(tasks, logger, params):
+    @_handle_exceptions(params)
+    def f_task(case):
+        context = CaseContext(case, logger, dry=True)
+        params.output_queues.put((case, any(context.resolve(task).stale for task in tasks)))
+    _run_task(f_task, params)
+
+def _run_cases(tasks, logger, single, stale, params):
+    @_handle_exceptions(params)
+    def f_task(item):
+        case, is_stale = item
+        if is_stale == stale:
+            results = CaseContext(case, logger).run(tasks)
+            params.output_queues.put((case, results[0] if single else results))
+    _run_task(f_task, params)
+
+def task_map(tasks, stage=_QueueStatus.UNDEFINED, workers=1, hit_workers=1, logger=None, maxsize=0,
+             worker_constructor=mp.Process):
+    """Creates a stage that runs a Task DAG over the case names coming from `stage` and yields `(case, result)`,
+    `result` being a list if `tasks` is a list. Each case is first checked against the caches of the DAG without
+    loading anything. Cases whose outputs are all fresh are loaded by `hit_workers` workers and the others are
+    computed by `workers` workers, so on a mostly warm cache hits come out while the misses are still running.
+    Order is not preserved.
+    Args:
+        tasks: an output Task, or a list of them evaluated together per case.
+        stage: a stage or iterable of case names.
+        workers: the number of workers computing stale cases.
+        hit_workers: the number of workers checking caches and loading fresh cases.
+        logger: logger passed to the Tasks, by default the one of this module.
+        maxsize: the maximum number of objects each of the stages can hold simultaneously. The stale cases queue
+            without bound, they are only names and a full queue would hold the hits back behind them.
+        worker_constructor: the worker type of the stages, `multiprocessing.Process` or `threading.Thread`.
+    Returns:
+        If the `stage` parameters is given then this function returns a new stage, else it returns a `Partial`.
+    """
+    if stage == _QueueStatus.UNDEFINED:
+        return Partial(lambda stage: task_map(tasks, stage, workers=workers, hit_workers=hit_workers, logger=logger,
+                                              maxsize=maxsize, worker_constructor=worker_constructor))
+    single = isinstance(tasks, TaskMixin)
+    task_list = [tasks] if single else list(tasks)
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    stage = _to_stage(stage, worker_constructor=worker_constructor)
+    routed = _Stage(worker_constructor=worker_constructor, workers=hit_workers, maxsize=maxsize, target=_route,
+                    args=(task_list, logger), dependencies=[stage])
+    hits, misses = [
+        _Stage(worker_constructor=worker_constructor, workers=count, maxsize=size, target=_run_cases,
+               args=(task_list, logger, single, stale), dependencies=[routed])
+        for count, stale, size in ((hit_workers, False, maxsize), (workers, True, UNBOUNDED))]
+    return concat([hits, misses], maxsize=maxsize, worker_constructor=worker_constructor)
+
+def _to_stage(obj, chunksize=1, worker_constructor=mp.Process):
     if isinstance(obj, _Stage):
         return obj
     elif hasattr(obj, "__iter__"):
-        return from_iterable(obj)
+        return from_iterable(obj, chunksize=chunksize, worker_constructor=worker_constructor)
     else:
         raise ValueError("Object {obj} is not iterable".format(obj=obj))
 
 def _from_iterable(iterable, params):
     def f_task():
+        checked = monotonic()
         for x in iterable:
             params.output_queues.put(x)
+            now = monotonic()
+            if now - checked > POLL_TIMEOUT:
+                if params.pipeline_error.is_set():
+                    return
+                checked = now
     _run_task(f_task, params)
 
-def from_iterable(iterable=_QueueStatus.UNDEFINED, maxsize=None):
+def from_iterable(iterable=_QueueStatus.UNDEFINED, maxsize=None, chunksize=1, worker_constructor=mp.Process):
     """
     Creates a stage from an iterable. All functions that accept stages or iterables use this function
     when an iterable is passed to convert it into a stage using the default arguments.
     Args:
         iterable: a source iterable.
-        maxsize: this parameter is not used and only kept for API compatibility with the other modules.
+        maxsize: the maximum number of objects waiting downstream of the source, so the iterable is only
+            consumed as fast as the next stage keeps up. `None` or `0` leaves it to the pipeline budget.
         worker_constructor: defines the worker type for the producer stage.
+        chunksize: the number of items sent downstream as one queue message. Items are held back until a chunk is
+            full, so keep it small for slow iterables.
     Returns:
         If the `iterable` parameters is given then this function returns a new stage, else it returns a `Partial`.
     """
     if iterable == _QueueStatus.UNDEFINED:
-        return Partial(lambda iterable: from_iterable(iterable, maxsize=maxsize))
+        return Partial(lambda iterable: from_iterable(
+            iterable, maxsize=maxsize, chunksize=chunksize, worker_constructor=worker_constructor))
     return _Stage(
-        worker_constructor=mp.Process,
+        worker_constructor=worker_constructor,
         workers=1,
-        maxsize=None,
+        maxsize=maxsize or 0,
         target=_from_iterable,
         args=(iterable, ),
         dependencies=[],
+        chunksize=chunksize,
     )
 
+def _is_thread(stage: _Stage) -> bool:
+    return isinstance(stage.worker_constructor, type) and issubclass(stage.worker_constructor, threading.Thread)
+
 _InputQueueDict = Dict[_Stage, _InputQueue]
 _OutputQueueDict = Dict[_Stage, _OutputQueueList]
 
+def _walk(stage: _Stage, visited: Set[_Stage]):
+    if stage in visited:
+        return
+    visited.add(stage)
+    yield stage
+    for _stage in stage.dependencies:
+        yield from _walk(_stage, visited)
+
+def _stage_name(stage: _Stage) -> str:
+    f = stage.args[0] if len(stage.args) > 0 and callable(stage.args[0]) else None
+    name = stage.target.__name__.lstrip("_")
+    return "{name}({f})".format(name=name, f=getattr(f, "__name__", "")) if f is not None else name
+
+def _queue_size(stage: _Stage, default_maxsize: int) -> int:
+    """An explicit `maxsize` of the stage, or of a source feeding it, takes precedence over the budget share."""
+    if stage.maxsize == UNBOUNDED:
+        return 0
+    sizes = [stage.maxsize] + [s.maxsize for s in stage.dependencies if len(s.dependencies) == 0]
+    sizes = [size for size in sizes if size]
+    return min(sizes) if sizes else default_maxsize
+
 def _build_queues(stage: _Stage, stage_input_queue: _InputQueueDict,
                   stage_output_queues: _OutputQueueDict, visited: Set[_Stage],
-                  pipeline_namespace: Namespace) -> Tuple[_InputQueueDict, _OutputQueueDict]:
+                  new_queue: Callable[[_Stage], _InputQueue]) -> Tuple[_InputQueueDict, _OutputQueueDict]:
     if stage in visited:
         return stage_input_queue, stage_output_queues
     else:
         visited.add(stage)
     if len(stage.dependencies) > 0:
-        total_done = sum([s.workers for s in stage.dependencies])
-        input_queue = _InputQueue(stage.maxsize, total_done, pipeline_namespace)
+        input_queue = new_queue(stage)
         stage_input_queue[stage] = input_queue
         for _stage in stage.dependencies:
             if _stage not in stage_output_queues:
-                stage_output_queues[_stage] = _OutputQueueList([input_queue])
+                stage_output_queues[_stage] = _OutputQueueList([input_queue], _stage.chunksize)
             else:
                 stage_output_queues[_stage].append(input_queue)
             stage_input_queue, stage_output_queues = _build_queues(
@@ -340,52 +677,374 @@ def _build_queues(stage: _Stage, stage_input_queue: _InputQueueDict,
                 stage_input_queue,
                 stage_output_queues,
                 visited,
-                pipeline_namespace=pipeline_namespace,
+                new_queue=new_queue,
             )
     return stage_input_queue, stage_output_queues
 
-def _to_iterable(stage, maxsize):
-    pipeline_namespace = _MANAGER.Namespace()
-    pipeline_namespace.error = False  # type: ignore
-    pipeline_error_queue: mp.Queue = mp.Queue()
-    input_queue = _InputQueue(maxsize, stage.workers, pipeline_namespace)
-    stage_input_queue, stage_output_queues = _build_queues(
-        stage=stage,
-        stage_input_queue=dict(),
-        stage_output_queues=dict(),
-        visited=set(),
-        pipeline_namespace=pipeline_namespace,
-    )
-    stage_output_queues[stage] = _OutputQueueList([input_queue])
-    processes = []
-    for _stage in stage_output_queues:
-        for index in range(_stage.workers):
-            stage_params = _StageParams(
-                output_queues=stage_output_queues[_stage],
-                input_queue=stage_input_queue.get(_stage, None),
-                pipeline_namespace=pipeline_namespace,
-                pipeline_error_queue=pipeline_error_queue,
+class _Job(
+        namedtuple("_Job", [
+            "target",
+            "args",
+            "input_slot",
+            "consumers",
+            "output_slots",
+            "chunksize",
+            "index",
+            "status_slot",
+            "shared_memory",
+        ])):
+    """One stage worker of a pipeline run on a `WorkerPool`, with its queues given by bank slot."""
+
+class _Bank(object):
+    """The queues and counters of a `WorkerPool`. They are created before its workers are forked, which is the
+    only way for a process to get them, and every pipeline run on the pool reuses them."""
+    def __init__(self, queues, statuses, maxsize):
+        self.pipeline_error = mp.Event()
+        self.pipeline_error_queue = mp.Queue()
+        self.queues = [_InputQueue(maxsize, 0, self.pipeline_error) for _ in range(queues)]
+        for slot, queue in enumerate(self.queues):
+            queue.slot = slot
+        self.statuses = [StageStatus(0) for _ in range(statuses)]
+
+    def params(self, job: _Job) -> _StageParams:
+        input_queue = None
+        if job.input_slot is not None:
+            input_queue = self.queues[job.input_slot]
+            input_queue.consumers = job.consumers
+        return _StageParams(
+            input_queue=input_queue,
+            output_queues=_OutputQueueList([self.queues[slot] for slot in job.output_slots], job.chunksize,
+                                           job.shared_memory),
+            pipeline_error=self.pipeline_error,
+            pipeline_error_queue=self.pipeline_error_queue,
+            index=job.index,
+            stage_status=self.statuses[job.status_slot],
+        )
+
+def _pool_worker(bank: _Bank, jobs: mp.Queue, finished: mp.Queue):
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job = pickle.loads(job)
+        params = bank.params(job)
+        try:
+            job.target(*job.args, params)
+        except BaseException as e:
+            _report_exception(params, e)
+        finished.put(job.index)
+
+class WorkerPool(object):
+    """
+    Worker processes that run the process stages of one pipeline after another, so that a job building many short
+    pipelines forks its workers once. Pass it to `to_iterable`; a pool runs one pipeline at a time.
+
+    The workers are forked with a fixed set of queues, so unlike a plain pipeline the stage functions, their
+    arguments and source iterables must be picklable, and every queue holds up to the `maxsize` of the pool
+    instead of the size given to the stage or the pipeline. A pipeline that fails or is closed early leaves
+    its queues in an unknown state, so the pool replaces its workers before the next run.
+
+    Args:
+        workers: the number of worker processes, at least the total `workers` of the process stages of any
+            pipeline run on the pool.
+        queues: the number of queues a pipeline may use between process stages, `2 * workers + 1` by default.
+        maxsize: the maximum number of messages each queue holds, `0` for unbounded queues.
+    """
+    def __init__(self, workers: int, queues: int = None, maxsize: int = 0):
+        self.workers = workers
+        self.queues = queues or 2 * workers + 1
+        self.maxsize = maxsize
+        self._processes = []
+        self._busy = False
+        self._next_queue = 0
+        self._next_status = 0
+        self._start()
+
+    def _start(self):
+        if np is not None:
+            resource_tracker.ensure_running()  # see `PipelineIterator._start`
+        self._bank = _Bank(self.queues, self.workers, self.maxsize)
+        self._jobs = mp.Queue()
+        self._finished = mp.Queue()
+        self._processes = [
+            mp.Process(target=_pool_worker, args=(self._bank, self._jobs, self._finished), daemon=True)
+            for _ in range(self.workers)
+        ]
+        for p in self._processes:
+            p.start()
+
+    def _discard(self):
+        """Terminates the workers of a pipeline that did not finish, new ones start with the next pipeline."""
+        for p in self._processes:
+            p.terminate()
+        for p in self._processes:
+            p.join()
+        self._processes = []
+
+    def _reserve(self, process_workers: int):
+        if self._busy:
+            raise RuntimeError("The WorkerPool already runs a pipeline")
+        if process_workers > self.workers:
+            raise ValueError("The pipeline has {n} process workers, more than the {workers} of the WorkerPool".format(
+                n=process_workers, workers=self.workers))
+        if not self._processes:
+            self._start()
+        self._busy = True
+        self._next_queue = 0
+        self._next_status = 0
+
+    def _release(self):
+        self._busy = False
+
+    def _queue(self, producers: int, consumers: int) -> _InputQueue:
+        if self._next_queue >= self.queues:
+            raise ValueError("The pipeline needs more than the {queues} queues of the WorkerPool".format(
+                queues=self.queues))
+        queue = self._bank.queues[self._next_queue]
+        queue.remaining.value = producers
+        queue.consumers = consumers
+        self._next_queue += 1
+        return queue
+
+    def _status(self, workers: int) -> Tuple[int, StageStatus]:
+        slot, self._next_status = self._next_status, self._next_status + 1
+        status = self._bank.statuses[slot]
+        status._active_workers.value = workers
+        return slot, status
+
+    def close(self, timeout: float = 1.0):
+        """Stops the workers, terminating those still busy after `timeout` seconds."""
+        for _ in self._processes:
+            self._jobs.put(None)
+        deadline = monotonic() + timeout
+        for p in self._processes:
+            p.join(max(0, deadline - monotonic()))
+        self._discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class PipelineIterator(object):
+    """Iterator over the output of a pipeline, returned by `to_iterable`. The workers start on the first `next`.
+    `depths` shows how full each queue is while the pipeline runs: the stage behind a full queue is the bottleneck.
+
+    A consumer that stops early should `close` the iterator, or use it as a context manager, to stop the workers
+    right away instead of when the iterator is garbage collected.
+    """
+    def __init__(self, stage: _Stage, maxsize=0, budget=None, pool: WorkerPool = None, shared_memory: int = None):
+        self._pool = pool
+        stages = list(_walk(stage, set()))
+        if pool is None:
+            self._pipeline_error = mp.Event()
+            self._pipeline_error_queue: mp.Queue = mp.Queue()
+        else:
+            pool._reserve(sum(s.workers for s in stages if not self._is_thread(s)))
+            self._pipeline_error = pool._bank.pipeline_error
+            self._pipeline_error_queue = pool._bank.pipeline_error_queue
+        default_maxsize = 0
+        if budget:
+            default_maxsize = max(1, budget // (sum(1 for s in stages if len(s.dependencies) > 0) + 1))
+        try:
+            self._input_queue = self._new_queue(maxsize or default_maxsize, [stage], 1, local=self._is_thread(stage))
+            self._stage_input_queue, self._stage_output_queues = _build_queues(
+                stage=stage,
+                stage_input_queue=dict(),
+                stage_output_queues=dict(),
+                visited=set(),
+                new_queue=lambda s: self._new_queue(
+                    _queue_size(s, default_maxsize), s.dependencies, s.workers,
+                    local=self._is_thread(s) and all(self._is_thread(d) for d in s.dependencies)),
+            )
+        except BaseException:
+            self._release()
+            raise
+        self._stage_output_queues[stage] = _OutputQueueList([self._input_queue], stage.chunksize)
+        for output_queues in self._stage_output_queues.values():
+            output_queues.shared_memory = shared_memory
+        self._shared_memory = shared_memory
+        self._workers = []
+        self._jobs = 0
+        self._stage_status = dict()
+        self._items = None
+        self._closed = False
+
+    def _is_thread(self, stage: _Stage) -> bool:
+        # the tag and reorder stages of an ordered stage share a semaphore that a pool worker cannot inherit,
+        # so on a pool they run as threads of this process
+        return _is_thread(stage) or (self._pool is not None and stage.target in (_tag, _reorder))
+
+    def _new_queue(self, maxsize: int, producers: List[_Stage], consumers: int, local: bool) -> _InputQueue:
+        total_done = sum(s.workers for s in producers)
+        if self._pool is None or local:
+            return _InputQueue(maxsize, total_done, self._pipeline_error, consumers=consumers, local=local)
+        return self._pool._queue(total_done, consumers)
+
+    def _release(self):
+        if self._pool is not None:
+            self._pool._release()
+            self._pool = None
+
+    def depths(self) -> Dict[str, Tuple[int, int]]:
+        """`(messages waiting, maxsize)` of the input queue of every stage, by stage name, and of the pipeline
+        output as "output". A batch counts as one message. Waiting counts are None where the platform cannot
+        report them."""
+        depths = dict()
+        queues = list(self._stage_input_queue.items()) + [(None, self._input_queue)]
+        for stage, queue in queues:
+            name = "output" if stage is None else _stage_name(stage)
+            key, i = name, 1
+            while key in depths:
+                i += 1
+                key = "{name}#{i}".format(name=name, i=i)
+            depths[key] = (queue.qsize(), queue.maxsize)
+        return depths
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        try:
+            if self._items is None:
+                self._items = self._input_queue.items()
+                self._start()
+            return next(self._items)
+        except StopIteration:
+            pass
+        except BaseException:
+            self.close()
+            raise
+        try:
+            self._finish()
+        except BaseException:
+            self.close()
+            raise
+        raise StopIteration
+
+    def close(self, timeout: float = None):
+        """Stops the pipeline. The workers get `timeout` seconds, 1 by default, to leave their loops and run their
+        `on_done` hooks while the queues are drained, then the processes among them are terminated. A thread
+        worker busy in a call cannot be stopped and exits once the call returns."""
+        if not self._closed:
+            self._closed = True
+            if self._items is not None:
+                self._stop(1.0 if timeout is None else timeout)
+            self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        if hasattr(self, "_closed"):
+            self.close()
+
+    def _start(self):
+        if self._shared_memory is not None and np is not None:
+            # forked workers then share the tracker of this process, which sees a block created by one worker
+            # and unlinked by another as freed
+            resource_tracker.ensure_running()
+        for _stage in self._stage_output_queues:
+            if self._pool is not None and not self._is_thread(_stage):
+                self._start_jobs(_stage)
+                continue
+            # kept here because a started Process drops its args, and the shared counter must not be freed
+            # and handed to another pipeline while the workers still use it
+            stage_status = self._stage_status[_stage] = StageStatus(_stage.workers)
+            for index in range(_stage.workers):
+                stage_params = _StageParams(
+                    output_queues=self._stage_output_queues[_stage],
+                    input_queue=self._stage_input_queue.get(_stage, None),
+                    pipeline_error=self._pipeline_error,
+                    pipeline_error_queue=self._pipeline_error_queue,
+                    index=index,
+                    stage_status=stage_status,
+                )
+                worker_constructor = _stage.worker_constructor
+                if self._pool is not None and not _is_thread(_stage):
+                    worker_constructor = threading.Thread  # see `_is_thread`
+                worker = worker_constructor(target=_stage.target, args=_stage.args + (stage_params, ))
+                self._workers.append(worker)
+        # processes first, so that none is forked while a thread worker holds a lock
+        self._workers.sort(key=lambda p: isinstance(p, threading.Thread))
+        for p in self._workers:
+            p.daemon = True
+            p.start()
+
+    def _start_jobs(self, stage: _Stage):
+        input_queue = self._stage_input_queue.get(stage, None)
+        status_slot, self._stage_status[stage] = self._pool._status(stage.workers)
+        for index in range(stage.workers):
+            job = _Job(
+                target=stage.target,
+                args=stage.args,
+                input_slot=input_queue.slot if input_queue is not None else None,
+                consumers=stage.workers,
+                output_slots=[queue.slot for queue in self._stage_output_queues[stage]],
+                chunksize=stage.chunksize,
                 index=index,
+                status_slot=status_slot,
+                shared_memory=self._stage_output_queues[stage].shared_memory,
             )
-            process = _stage.worker_constructor(target=_stage.target, args=_stage.args + (stage_params, ))
-            processes.append(process)
-    for p in processes:
-        p.daemon = True
-        p.start()
-    try:
-        for x in input_queue:
-            yield x
-        if pipeline_namespace.error:  # type: ignore
-            error_class, _, trace = pipeline_error_queue.get()
+            # pickled here, so that an unpicklable function fails the pipeline instead of the queue feeder thread
+            self._pool._jobs.put(bytes(ForkingPickler.dumps(job)))
+            self._jobs += 1
+
+    def _wait_jobs(self, timeout=None):
+        deadline = None if timeout is None else monotonic() + timeout
+        while self._jobs > 0:
+            try:
+                self._pool._finished.get(timeout=None if deadline is None else max(0, deadline - monotonic()))
+            except Empty:
+                return
+            self._jobs -= 1
+
+    def _stop(self, timeout: float):
+        """Sets the error flag, which every worker checks at least every `POLL_TIMEOUT`, and drains the queues so
+        that no worker stays blocked on a put. Processes still running after `timeout` are terminated."""
+        self._pipeline_error.set()
+        queues = list(self._stage_input_queue.values()) + [self._input_queue]
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            for queue in queues:
+                queue.drain()
+            if self._jobs > 0:
+                self._wait_jobs(min(POLL_TIMEOUT, max(0, deadline - monotonic())))
+            elif any(p.is_alive() for p in self._workers):
+                sleep(POLL_TIMEOUT / 10)
+            if self._jobs == 0 and not any(p.is_alive() for p in self._workers):
+                break
+        for p in self._workers:
+            if isinstance(p, mp.Process) and p.is_alive():
+                p.terminate()
+        for p in self._workers:
+            if isinstance(p, mp.Process):
+                p.join()
+        if self._pool is not None:
+            self._pool._discard()
+            self._jobs = 0
+
+    def _finish(self):
+        if self._pipeline_error.is_set():
+            error_class, _, trace = self._pipeline_error_queue.get()
             raise error_class("\n\nOriginal {trace}".format(trace=trace))
-        for p in processes:
+        for p in self._workers:
             p.join()
-    except BaseException as e:
-        for q in stage_input_queue.values():
-            q.done()
-        raise e
+        if self._pool is not None:
+            self._wait_jobs()
+        self._closed = True
+        self._release()
+
+def _to_iterable(stage, maxsize, budget=None, pool=None, shared_memory=None):
+    return PipelineIterator(stage, maxsize, budget, pool, shared_memory)
 
-def to_iterable(stage=_QueueStatus.UNDEFINED, maxsize=0):
+def to_iterable(stage=_QueueStatus.UNDEFINED, maxsize=0, budget=DEFAULT_BUDGET, pool=None, shared_memory=None):
     """
     Creates an iterable from a stage. This function is used by the stage's `__iter__` method with the default arguments.
 
@@ -393,12 +1052,20 @@ def to_iterable(stage=_QueueStatus.UNDEFINED, maxsize=0):
         stage: a stage object.
         maxsize: the maximum number of objects the stage can hold simultaneously, if set to `0` (default) then
     the stage can grow unbounded.
+        budget: the number of queue messages the whole pipeline may hold, split evenly over the queues without
+            an explicit `maxsize`, so that a fast producer blocks instead of buffering its whole input. `None`
+            leaves those queues unbounded.
+        pool: a `WorkerPool` that runs the process stages instead of new processes.
+        shared_memory: numpy arrays of at least this many bytes, also inside lists, tuples and dicts, pass
+            between processes through shared memory instead of being pickled. The consumer gets an array backed
+            by the block, which is freed with the array. `None` pickles everything.
 
     Returns:
-        If the `stage` parameters is given then this function returns an iterable, else it returns a `Partial`.
+        If the `stage` parameters is given then this function returns a `PipelineIterator`, else it returns a
+        `Partial`.
     """
 
     if stage == _QueueStatus.UNDEFINED:
-        return Partial(lambda stage: _to_iterable(stage, maxsize))
+        return Partial(lambda stage: _to_iterable(stage, maxsize, budget, pool, shared_memory))
     else:
-        return _to_iterable(stage, maxsize)
+        return _to_iterable(stage, maxsize, budget, pool, shared_memory)
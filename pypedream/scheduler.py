@@ -0,0 +1,115 @@
+"""Run Task DAGs over many cases as a graph of (node, case) jobs, so independent branches of a case run in parallel."""
+from typing import Dict, List, Optional, Tuple, Union
+from collections import deque
+from logging import Logger
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+from queue import Queue
+import logging
+from .task import TaskMixin, Task, CaseContext, prefetch
+from .metrics import metrics, Metrics
+
+Job = Tuple[TaskMixin, str]
+
+def _ensure(node: TaskMixin, case: str, logger: Logger) -> Metrics:
+    """Brings one job up to date, returning the metrics recorded by the worker since its last job."""
+    CaseContext(case, logger).ensure(node)
+    return metrics.take()
+
+class Scheduler(object):
+    """Dispatch every stale (node, case) pair to a worker pool as soon as the jobs of its dependencies are done.
+    Workers save results to the node's cache and downstream jobs load them from there, nothing is sent back through
+    the parent process. Staleness is planned up front with a dry CaseContext, and each job checks again before
+    computing, so hash-invalidated nodes whose inputs turned out unchanged are skipped.
+    Args:
+        workers: number of workers, by default all but 3 cores.
+        backend: 'process' or 'thread'.
+        limits: maximum number of concurrent jobs per stage name, e.g. for memory hungry stages. At least 1.
+    """
+    def __init__(self, workers: Optional[int] = None, backend: str = "process", limits: Optional[Dict[str, int]] = None,
+                 logger: Optional[Logger] = None):
+        assert backend in ("process", "thread"), "backend must be 'process' or 'thread'"
+        self.workers = workers if workers is not None else max(1, cpu_count() - 3)
+        self.backend = backend
+        self.limits = limits if limits is not None else dict()
+        low = {name: limit for name, limit in self.limits.items() if limit < 1}
+        if low:
+            raise ValueError(f"stage limits must be at least 1, a stage limited to 0 would never run: {low}")
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+
+    def plan(self, cases: list, tasks: Union[TaskMixin, List[TaskMixin]]) -> Dict[Job, List[Job]]:
+        """Stale jobs, each with the stale jobs it depends on."""
+        graph: Dict[Job, List[Job]] = dict()
+        loaders = prefetch(cases, tasks)
+        for case in cases:
+            context = CaseContext(case, self.logger, dry=True, loaders=loaders)
+
+            def visit(node: TaskMixin) -> bool:
+                if (node, case) not in graph:
+                    if not isinstance(node, Task) or not context.resolve(node).stale:
+                        return False
+                    graph[(node, case)] = [(dep, case) for dep in node.dependencies or tuple() if visit(dep)]
+                return True
+            for task in ([tasks] if isinstance(tasks, TaskMixin) else tasks):
+                visit(task)
+        return graph
+
+    def run(self, cases: list, tasks: Union[TaskMixin, List[TaskMixin]], collect: bool = False) -> Optional[list]:
+        """Bring `tasks` up to date for all `cases`. With `collect` also load and return the results, shaped like
+        `get_result`."""
+        graph = self.plan(cases, tasks)
+        waiting: Dict[Job, int] = {job: len(deps) for job, deps in graph.items()}
+        dependents: Dict[Job, List[Job]] = {job: list() for job in graph}
+        for job, deps in graph.items():
+            for dep in deps:
+                dependents[dep].append(job)
+        ready = deque(job for job, count in waiting.items() if count == 0)
+        running: Dict[str, int] = dict()
+        done: Queue = Queue()
+        errors: List[Tuple[Job, BaseException]] = list()
+        pool = (Pool if self.backend == "process" else ThreadPool)(self.workers)
+        try:
+            in_flight = 0
+            while (ready and not errors) or in_flight > 0:
+                deferred = list()
+                while ready and in_flight < self.workers and not errors:
+                    node, case = job = ready.popleft()
+                    limit = self.limits.get(node.__name__)
+                    if limit is not None and running.get(node.__name__, 0) >= limit:
+                        deferred.append(job)
+                        continue
+                    running[node.__name__] = running.get(node.__name__, 0) + 1
+                    in_flight += 1
+                    pool.apply_async(_ensure, (node, case, self.logger),
+                                     callback=lambda worker_metrics, job=job: done.put((job, None, worker_metrics)),
+                                     error_callback=lambda error, job=job: done.put((job, error, None)))
+                ready.extendleft(reversed(deferred))
+                if in_flight == 0:
+                    break
+                job, error, worker_metrics = done.get()
+                if worker_metrics is not None:
+                    metrics.merge(worker_metrics)
+                in_flight -= 1
+                running[job[0].__name__] -= 1
+                if error is not None:
+                    self.logger.error("[Exception] stage: %s, case: %s", job[0].__name__, job[1])
+                    errors.append((job, error))
+                    continue
+                for dependent in dependents[job]:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0:
+                        ready.append(dependent)
+        finally:
+            pool.close()
+            pool.join()
+        if errors:
+            raise errors[0][1]
+        if not collect:
+            return None
+        single = isinstance(tasks, TaskMixin)
+        loaders = prefetch(cases, tasks)
+        results = [CaseContext(case, self.logger, loaders=loaders).run([tasks] if single else tasks)  # type: ignore
+                   for case in cases]
+        if single:
+            return [result[0] for result in results]
+        return [[result[index] for result in results] for index in range(len(tasks))]  # type: ignore
@@ -0,0 +1,125 @@
+"""Run one case list on several machines sharing `Task.save_folder`. Each node runs one shard of the cases, a fixed
+split by position or by case hash, and writes its results and metrics to the shard folder. Computes hold a `Lease`
+on (stage, case), so nodes whose cases share upstream work never compute it twice at the same time. Once all shards
+are written, `merge_shards` puts the results back in case order and sums the metrics. From the command line:
+    python -m pypedream.shard run my_project.pipeline:output_task --cases cases.txt --shard 0 --shards 4
+    python -m pypedream.shard merge --metrics metrics.prom
+"""
+from typing import Any, Dict, List, Optional, Tuple, Union
+from argparse import ArgumentParser
+from importlib import import_module
+from logging import Logger
+from pathlib import Path
+import hashlib
+import logging
+import pickle as pkl
+import sys
+from .fileobj import _atomic_path
+from .metrics import metrics, Metrics
+from .task import TaskMixin, Task, Executor
+
+SHARD_FOLDER = ".shards"
+SPLITS = ("index", "hash")
+
+def _shard_of(case: str, shards: int) -> int:
+    return int(hashlib.blake2b(str(case).encode(), digest_size=8).hexdigest(), 16) % shards
+
+def shard_positions(cases: list, shard: int, shards: int, by: str = "index") -> List[int]:
+    """Positions in `cases` of the cases of `shard`. 'index' gives each shard a contiguous block, 'hash' keeps a
+    case on the same shard however the list changes."""
+    assert by in SPLITS, f"by must be one of {SPLITS}"
+    assert 0 <= shard < shards, "shard must be in [0, shards)"
+    if by == "index":
+        return list(range(len(cases) * shard // shards, len(cases) * (shard + 1) // shards))
+    return [position for position, case in enumerate(cases) if _shard_of(case, shards) == shard]
+
+def shard_cases(cases: list, shard: int, shards: int, by: str = "index") -> list:
+    return [cases[position] for position in shard_positions(cases, shard, shards, by)]
+
+def _folder(name: str, folder: Optional[Path]) -> Path:
+    return Path(folder) if folder is not None else Task.save_folder.resolve().joinpath(SHARD_FOLDER, name)
+
+def run_shard(cases: list, tasks: Union[TaskMixin, List[TaskMixin]], shard: int, shards: int, by: str = "index",
+              name: str = "default", folder: Optional[Path] = None, workers: Optional[int] = None,
+              lease_ttl: float = 60., logger: Optional[Logger] = None) -> Path:
+    """Run the cases of `shard` on a local Executor of `workers` while holding leases of `lease_ttl` seconds,
+    then write their results and the metrics of the run to `<folder>/<shard>.pkl`, by default in
+    `Task.save_folder/.shards/<name>`. Returns that path."""
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    positions = shard_positions(cases, shard, shards, by)
+    with Executor(workers=workers, logger=logger, lease_ttl=lease_ttl) as executor:
+        results = [result for _, result in executor.imap([cases[x] for x in positions], tasks, ordered=True)]
+    run_metrics = metrics.take()
+    logger.info("[Metrics] shard %s/%s\n%s", shard, shards, run_metrics.report())
+    path = _folder(name, folder).joinpath(f"{shard}.pkl")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _atomic_path(path) as temp_path, open(temp_path, 'wb') as fp:
+        pkl.dump({"shard": shard, "shards": shards, "count": len(cases), "positions": positions,
+                  "results": results, "tasks": None if isinstance(tasks, TaskMixin) else len(tasks),
+                  "metrics": run_metrics}, fp)
+    return path
+
+def merge_shards(name: str = "default", folder: Optional[Path] = None) -> Tuple[list, Metrics]:
+    """Results of all shards in the order of the full case list, shaped like `get_result`, and the metrics of all
+    shards summed. Raises FileNotFoundError while a shard is missing."""
+    folder = _folder(name, folder)
+    parts: Dict[int, Dict[str, Any]] = dict()
+    for path in folder.glob("[0-9]*.pkl"):  # not the temporary files of shards being written
+        with open(path, 'rb') as fp:
+            part = pkl.load(fp)
+        parts[part["shard"]] = part
+    if len(parts) == 0:
+        raise FileNotFoundError(f"no shard results in {folder}")
+    shards = next(iter(parts.values()))["shards"]
+    assert all(part["shards"] == shards for part in parts.values()), f"shards of different splits in {folder}"
+    missing = sorted(set(range(shards)) - set(parts))
+    if missing:
+        raise FileNotFoundError(f"shards {missing} of {shards} missing in {folder}")
+    total = Metrics()
+    ordered: Dict[int, Any] = dict()
+    for part in parts.values():
+        total.merge(part["metrics"])
+        ordered.update(zip(part["positions"], part["results"]))
+    part = parts[0]
+    assert sorted(ordered) == list(range(part["count"])), f"shards of different case lists in {folder}"
+    results = [ordered[position] for position in range(part["count"])]
+    if part["tasks"] is None:
+        return results, total
+    return [[result[index] for result in results] for index in range(part["tasks"])], total
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("command", choices=["run", "merge"])
+    parser.add_argument("tasks", nargs="?", help="module:attribute of an output Task or list of Tasks, for run")
+    parser.add_argument("--cases", help="text file with one case name per line, for run")
+    parser.add_argument("--shard", type=int, default=0)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--by", choices=SPLITS, default="index")
+    parser.add_argument("--name", default="default")
+    parser.add_argument("--folder", type=Path, default=None, help="shard folder, Task.save_folder/.shards/<name>")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--lease-ttl", type=float, default=60.)
+    parser.add_argument("--output", default=None, help="pickle the merged results to this file, for merge")
+    parser.add_argument("--metrics", default=None, help="write the merged metrics to this .json or .prom file")
+    args = parser.parse_args()
+    if args.command == "run":
+        assert args.tasks is not None and args.cases is not None, "run needs tasks and --cases"
+        sys.path.insert(0, "")
+        module, attribute = args.tasks.split(":")
+        tasks = getattr(import_module(module), attribute)
+        with open(args.cases) as fp:
+            cases = [line.strip() for line in fp if line.strip()]
+        path = run_shard(cases, tasks, args.shard, args.shards, by=args.by, name=args.name, folder=args.folder,
+                         workers=args.workers, lease_ttl=args.lease_ttl)
+        print(f"shard {args.shard}/{args.shards}: {path}")
+    else:
+        results, total = merge_shards(args.name, args.folder)
+        if args.output is not None:
+            with open(args.output, 'wb') as fp:
+                pkl.dump(results, fp)
+        if args.metrics is not None:
+            total.save(args.metrics)
+        print(total.report())
+
+if __name__ == '__main__':
+    main()
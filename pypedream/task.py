@@ -1,16 +1,122 @@
-from typing import Any, List, Callable, Optional, Tuple, Type, Union
-from inspect import getfullargspec
+from typing import Any, Dict, Iterator, List, Callable, Optional, Tuple, Type, Union
+from collections import deque, namedtuple
+from functools import partial
+from inspect import getfullargspec, unwrap
+from math import ceil
+from types import CodeType
+import hashlib
+import json
 from pathlib import Path
 from datetime import datetime
-from time import mktime
+from time import mktime, time as now
 from multiprocessing import Pool, cpu_count
 from logging import Logger
-from .fileobj import FileObj, Zip7Cacher, InputObj  # type: ignore
+import logging
+from .fileobj import FileObj, Zip7Cacher, InputObj, content_hash, _atomic_path  # type: ignore
 from .logger import getLogger  # type: ignore
+from .metrics import metrics, Metrics
+from .lease import Lease
+
+DURATION_FILE = ".durations"
+DURATION_LIMIT = 1000  # run times of a stage read by the planner
+DURATION_TRIM = 4  # the history is cut back to DURATION_LIMIT entries when it grows this many times larger
+
+class NodeState(namedtuple("NodeState", ["stale", "time", "reason"])):
+    """Freshness of one node for one case. `time` is the cache mtime, 0 when a dependency is stale.
+    `reason` is empty for fresh nodes, else one of 'dependency', 'missing', 'self' or 'dependency-newer'."""
+    pass
+
+_MISSING = object()
+
+class CaseContext(object):
+    """Execute/load plan of a Task DAG for one case. Every node is resolved once in a single topological pass,
+    so nodes shared by several consumers don't stat their caches again.
+    Results are kept while some pending consumer still needs them and dropped after the last one has run, so
+    no node is executed or loaded twice and only the live frontier of the DAG is held in memory.
+    A `dry` context only plans: hash-invalidated nodes downstream of a stale node count as stale instead of
+    evaluating it. `loaders` are the InputObj of Input nodes by case, as returned by `prefetch`; contexts of
+    many cases can share them. With `lease_ttl` every Task computes while holding a `Lease` of that many seconds
+    on its (stage, case), so processes sharing the cache folder never compute the same one at once."""
+
+    def __init__(self, name: str, logger: Logger, dry: bool = False,
+                 loaders: Optional[Dict["Input", Dict[str, InputObj]]] = None, lease_ttl: Optional[float] = None):
+        self.name = name
+        self.logger = logger
+        self.dry = dry
+        self.loaders = loaders if loaders is not None else dict()
+        self.lease_ttl = lease_ttl
+        self.states: Dict["TaskMixin", NodeState] = dict()
+        self.results: Dict["TaskMixin", Any] = dict()
+        self.consumers: Dict["TaskMixin", int] = dict()
+        self.digests: Dict["TaskMixin", str] = dict()
+
+    def resolve(self, task: "TaskMixin") -> NodeState:
+        state = self.states.get(task)
+        if state is None:
+            with metrics.timer(task.__name__, "check"):
+                state = task._resolve(self)
+            self.states[task] = state
+        return state
+
+    def run(self, tasks: List["TaskMixin"]) -> List[Any]:
+        """Evaluate several output tasks for this case, sharing every common upstream result."""
+        for task in tasks:
+            self._count(task)
+        return [self.fetch(task) for task in tasks]
+
+    def ensure(self, task: "TaskMixin") -> bool:
+        """Bring a node's cache up to date without loading it when already fresh. True if it was evaluated."""
+        if not self.resolve(task).stale:
+            return False
+        self.run([task])
+        return True
+
+    def fetch(self, task: "TaskMixin") -> Any:
+        """Result of a counted node. Evaluated on first fetch, evicted on its last."""
+        if task in self.results:
+            result = self.results[task]
+        else:
+            stale = self.resolve(task).stale
+            result = task._evaluate(self)
+            if stale:
+                self.states[task] = NodeState(False, now(), "")
+        remaining = self.consumers.get(task, 1) - 1
+        self.consumers[task] = remaining
+        if remaining > 0:
+            self.results[task] = result
+        else:
+            self.results.pop(task, None)
+        return result
+
+    def digest(self, task: "TaskMixin", hint: Optional[list] = None, value: Any = _MISSING) -> str:
+        """Digest of a node's result, used as input key by hash-invalidated consumers. A stale node is evaluated
+        first and its result held for its consumers, so an unchanged result can stop the rebuild cascade.
+        `hint` is the [time, digest] pair the consumer recorded for this node last time, `value` its result
+        if already at hand."""
+        digest = self.digests.get(task)
+        if digest is None:
+            if self.resolve(task).stale:
+                if self.dry:
+                    return f"stale:{task.__name__}"
+                self.results[task] = task._evaluate(self)
+                self.states[task] = NodeState(False, now(), "")
+            digest = self.digests.get(task)
+            if digest is None:
+                digest = task._digest(self, hint, value)
+                self.digests[task] = digest
+        return digest
+
+    def _count(self, task: "TaskMixin"):
+        count = self.consumers.get(task, 0)
+        self.consumers[task] = count + 1
+        if count == 0 and task not in self.results and self.resolve(task).stale:
+            for dependency in task.dependencies or tuple():
+                self._count(dependency)
 
 class TaskMixin(object):
     save_folder = Path("")
     __name__ = ""
+    dependencies: Optional[List["TaskMixin"]] = None
 
     def _set_time(self, time: str) -> float:
         self.__time__ = mktime(datetime.fromisoformat(time).timetuple())
@@ -22,21 +128,76 @@ class TaskMixin(object):
     def path(self) -> Path:
         return self.save_folder.resolve().joinpath(self.__name__)
 
-    def _needs_update(self, name: str, logger: Logger) -> Tuple[bool, float]:
+    def _resolve(self, context: CaseContext) -> NodeState:
         raise NotImplementedError
 
-    def run(self, name: str, logger: Logger) -> Any:
+    def _needs_update(self, name: str, logger: Logger) -> Tuple[bool, float]:
+        state = CaseContext(name, logger).resolve(self)
+        return state.stale, state.time
+
+    def _evaluate(self, context: CaseContext) -> Any:
         raise NotImplementedError
 
+    def _digest(self, context: CaseContext, hint: Optional[list], value: Any = _MISSING) -> str:
+        return f"time:{context.resolve(self).time}"
+
+    def run(self, name: str, logger: Logger, context: Optional[CaseContext] = None) -> Any:
+        """Evaluate this node for case `name`. Pass the same `context` to share results between several outputs."""
+        if context is None:
+            context = CaseContext(name, logger)
+        return context.run([self])[0]
+
+def _code_hash(code: CodeType, digest) -> None:
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            _code_hash(const, digest)
+        else:
+            digest.update(repr(const).encode())
+
+def _fn_hash(fn: Callable, digest) -> None:
+    fn = unwrap(fn)
+    if isinstance(fn, partial):
+        _fn_hash(fn.func, digest)
+        digest.update(content_hash((fn.args, fn.keywords)).encode())
+        return
+    code = getattr(fn, "__code__", None)
+    if code is not None:
+        _code_hash(code, digest)
+        digest.update(content_hash((getattr(fn, "__defaults__", None), getattr(fn, "__kwdefaults__", None))).encode())
+    elif hasattr(type(fn).__call__, "__code__"):  # an instance of a class defining __call__
+        _fn_hash(type(fn).__call__, digest)
+        digest.update(content_hash(fn).encode())
+    else:  # a builtin, whose name is stable across processes
+        digest.update(f"{getattr(fn, '__module__', '')}.{getattr(fn, '__qualname__', type(fn).__qualname__)}".encode())
+
+def _fingerprint(fn: Callable) -> str:
+    """Hash of a function's bytecode, names, constants and default arguments. Unaffected by moving it around in its
+    file. Partials add their arguments and callable instances their state."""
+    digest = hashlib.blake2b(digest_size=16)
+    _fn_hash(fn, digest)
+    return digest.hexdigest()
+
 class Task(TaskMixin):
     def __init__(self, fn: Callable, time: str, name: Optional[str] = None, file_cacher: type = Zip7Cacher,
-                 extra_args: tuple = tuple()):
+                 extra_args: tuple = tuple(), cacher_options: Optional[Dict[str, Any]] = None,
+                 invalidation: str = "time"):
+        """
+        Args:
+            invalidation: 'time' makes the cache stale when older than `time` or a dependency's cache.
+                'hash' keys the cache by the hash of `fn`'s bytecode, `extra_args` and the content of upstream
+                results, so it is only rebuilt when one of those actually changes. `time` still forces a rebuild.
+        """
         self.__name__ = name if name is not None else fn.__name__
         self._set_time(time)
         self.__fn__ = fn
         assert issubclass(file_cacher, FileObj), "A file cacher class must be a subtype of FileObj"
         self.file_cacher = file_cacher
+        self.cacher_options = cacher_options if cacher_options is not None else dict()
         self.extra_args = extra_args
+        assert invalidation in ("time", "hash"), "invalidation must be 'time' or 'hash'"
+        self.invalidation = invalidation
         self.dependencies: List[TaskMixin] = list()
 
     @property
@@ -56,60 +217,184 @@ class Task(TaskMixin):
         self.dependencies = [dependency] if isinstance(dependency, TaskMixin) else dependency
         return self
 
+    def cacher(self, name: str) -> FileObj:
+        return self.file_cacher(self.path().joinpath(name), **self.cacher_options)
+
+    def _record_duration(self, name: str, duration: float):
+        """Append to the stage's run time history, read by the planner to project rebuild costs. Once the file
+        holds about `DURATION_TRIM` times `DURATION_LIMIT` entries it is cut back to the last `DURATION_LIMIT`."""
+        self.path().mkdir(parents=True, exist_ok=True)
+        line = f"{name}\t{duration:.6f}\n"
+        with open(self.path().joinpath(DURATION_FILE), 'a') as fp:
+            fp.write(line)
+            size = fp.tell()
+        if size > DURATION_TRIM * DURATION_LIMIT * len(line):  # entries of a stage have about the same length
+            history = self._duration_lines(DURATION_LIMIT)
+            # entries appended by other processes while the file is replaced are lost, the history is only a sample
+            with _atomic_path(self.path().joinpath(DURATION_FILE)) as temp_path, open(temp_path, 'w') as fp:
+                fp.writelines(history)
+
+    def _duration_lines(self, limit: int) -> List[str]:
+        try:
+            with open(self.path().joinpath(DURATION_FILE)) as fp:
+                return list(deque(fp, maxlen=limit))
+        except FileNotFoundError:
+            return list()
+
+    def durations(self, limit: int = DURATION_LIMIT) -> List[float]:
+        """Most recent recorded run times of this stage, in seconds. Lines that don't parse, such as appends
+        torn by a crashed worker, are skipped."""
+        durations = list()
+        for line in self._duration_lines(limit):
+            try:
+                durations.append(float(line.rsplit("\t", 1)[1]))
+            except (IndexError, ValueError):
+                pass
+        return durations
+
+    def _record_path(self, name: str) -> Path:
+        return self.path().joinpath(".keys", name + ".json")
+
+    def _read_record(self, name: str) -> Optional[dict]:
+        """Keys of the current cache of a hash-invalidated Task, None if never recorded."""
+        try:
+            with open(self._record_path(name)) as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return None
+
+    def _input_key(self, context: CaseContext, hints: Dict[str, list]) -> str:
+        if getattr(self, "_fn_key", None) is None:
+            self._fn_key = _fingerprint(self.__fn__) + content_hash(self.extra_args)
+        digest = hashlib.blake2b(self._fn_key.encode(), digest_size=16)
+        for dependency in self.dependencies or tuple():
+            digest.update(context.digest(dependency, hints.get(dependency.__name__)).encode())
+        return digest.hexdigest()
+
+    def _resolve_hash(self, context: CaseContext) -> NodeState:
+        name, logger = context.name, context.logger
+        record = self._read_record(name)
+        own_time = self.cacher(name).time()
+        if record is None or own_time == 0:
+            logger.debug("[Update Needed] no keyed cache. %s: %s", name, self.__name__)
+            return NodeState(True, own_time, "missing")
+        if own_time < self.__time__:
+            logger.debug("[Update Needed] self. %s: %s <%s < %s>", name, self.__name__, own_time, self.__time__)
+            return NodeState(True, own_time, "self")
+        if self._input_key(context, record["inputs"]) != record["key"]:
+            logger.debug("[Update Needed] function or inputs changed. %s: %s", name, self.__name__)
+            return NodeState(True, own_time, "dependency")
+        logger.debug("[Update Not Needed] %s: %s", name, self.__name__)
+        return NodeState(False, own_time, "")
+
+    def _save_hash(self, context: CaseContext, cache: FileObj, result: Any, args: list):
+        """Save unless the result is identical to the cached one, in which case the cache keeps its mtime."""
+        name = context.name
+        digest = content_hash(result)
+        record = self._read_record(name)
+        state = context.resolve(self)
+        if record is None or record["digest"] != digest or state.time == 0 or state.time < self.__time__:
+            cache.save(result)
+        else:
+            context.logger.info("[Unchanged] result identical to cache. %s: %s", self.__name__, name)
+        inputs = {dependency.__name__: [context.resolve(dependency).time, context.digest(dependency, None, arg)]
+                  for dependency, arg in zip(self.dependencies, args)}
+        record = {"key": self._input_key(context, inputs), "digest": digest, "inputs": inputs}
+        context.digests[self] = digest
+        self._record_path(name).parent.mkdir(parents=True, exist_ok=True)
+        with _atomic_path(self._record_path(name)) as temp_path, open(temp_path, 'w') as fp:
+            json.dump(record, fp)
+
+    def _digest(self, context: CaseContext, hint: Optional[list], value: Any = _MISSING) -> str:
+        if self.invalidation == "hash":
+            record = self._read_record(context.name)
+            if record is not None:
+                return record["digest"]
+        return f"time:{self.cacher(context.name).time()}"
+
     def __str__(self) -> str:
         return self.__name__ + ": " + datetime.fromtimestamp(self.__time__).isoformat()
 
-    def _needs_update(self, name, logger) -> Tuple[bool, float]:
-        cache = self.file_cacher(self.path().joinpath(name))
+    def _resolve(self, context: CaseContext) -> NodeState:
+        if self.invalidation == "hash":
+            return self._resolve_hash(context)
+        name, logger = context.name, context.logger
         truth_flag = False
         dep_time = 0.
-        for x in self.dependencies:
-            dep_update, _dep_time = x._needs_update(name, logger)
-            if dep_update:
+        for x in (self.dependencies or tuple()):
+            dep_state = context.resolve(x)
+            if dep_state.stale:
                 truth_flag = True
             else:
-                dep_time = max(_dep_time, dep_time)
+                dep_time = max(dep_state.time, dep_time)
         if truth_flag:
-            logger.debug(f"[Update Needed] due to dependency. {name}: {self.__name__}")
-            return True, 0
-        own_time = cache.time()
+            logger.debug("[Update Needed] due to dependency. %s: %s", name, self.__name__)
+            return NodeState(True, 0, "dependency")
+        own_time = self.cacher(name).time()
         if (own_time < self.__time__):
-            logger.debug(f"[Update Needed] self. {name}: {self.__name__} <{own_time} < {self.__time__}>")
-            return True, own_time
+            logger.debug("[Update Needed] self. %s: %s <%s < %s>", name, self.__name__, own_time, self.__time__)
+            return NodeState(True, own_time, "missing" if own_time == 0 else "self")
         if dep_time > own_time:
-            logger.debug(f"[Update Needed] dependency newer than self."
-                         f" {name}: {self.__name__} <{own_time} < {dep_time}>")
-            return True, own_time
-        logger.debug(f"[Update Not Needed] {name}: {self.__name__}")
-        return False, own_time
+            logger.debug("[Update Needed] dependency newer than self. %s: %s <%s < %s>", name, self.__name__,
+                         own_time, dep_time)
+            return NodeState(True, own_time, "dependency-newer")
+        logger.debug("[Update Not Needed] %s: %s", name, self.__name__)
+        return NodeState(False, own_time, "")
 
-    def run(self, name: str, logger: Logger) -> Any:
+    def _evaluate(self, context: CaseContext) -> Any:
         """Runs the self.__fn__ if not have up-to-date cache, else return cached data.
         Update-to-date cache has mtime larger then the Task object.
-        Use data input from args dict passed from the backend if supplied else calculate dependencies.
-        If has supplied input then skip dependencies. If has cache then skip self.
+        Freshness of the whole DAG is resolved once per case into `context`, dependencies are fetched from it.
+        If has cache then skip self.
         If has no dependencies and input not supplied, raise a ValueError.
         """
-        cache = self.file_cacher(self.path().joinpath(name))
-        logger.debug(f"check update from {self.__name__}")
-        if not self._needs_update(name, logger)[0]:
-            logger.info(f"[Cache Hit] loading interim data. {self.__name__}: {name}")
+        name, logger = context.name, context.logger
+        cache = self.cacher(name)
+        logger.debug("check update from %s", self.__name__)
+        state = context.resolve(self)
+        if not state.stale:
+            return self._load(context, cache)
+        elif self.dependencies is None:
+            raise ValueError(f"Input Node '{self.__name__}' lacks input.")
+        elif context.lease_ttl is None:
+            return self._compute(context, cache, state)
+        with Lease(self.path(), name, context.lease_ttl):
+            # another process may have brought this and upstream caches up to date since `state` was resolved,
+            # whether it still held the lease or had released it already
+            state = CaseContext(name, logger, loaders=context.loaders).resolve(self)
+            if not state.stale:
+                context.states[self] = state
+                return self._load(context, cache)
+            return self._compute(context, cache, state)
+
+    def _load(self, context: CaseContext, cache: FileObj) -> Any:
+        context.logger.info("[Cache Hit] loading interim data. %s: %s", self.__name__, context.name)
+        with metrics.timer(self.__name__, "load") as timing:
             result = cache.load()
-        elif self.dependencies is not None:
-            logger.debug(f"[Cache Miss] {self.__name__}: {name} "
-                         f"| time: {cache.time()} -> {self.__time__}")
-            prev_args = [task.run(name, logger) for task in self.dependencies]
-            logger.info(f"[Cache Miss] using dependencies. {self.__name__}: {name}")
-            try:
+            timing.nbytes = cache.bytes_read
+        return result
+
+    def _compute(self, context: CaseContext, cache: FileObj, state: NodeState) -> Any:
+        name, logger = context.name, context.logger
+        logger.debug("[Cache Miss] %s: %s | time: %s -> %s", self.__name__, name, state.time, self.__time__)
+        prev_args = [context.fetch(task) for task in self.dependencies]
+        logger.info("[Cache Miss] using dependencies. %s: %s", self.__name__, name)
+        try:
+            with metrics.timer(self.__name__, "compute") as timing:
                 result = self.__fn__(*(tuple(prev_args) + self.extra_args))
-            except Exception as e:
-                import traceback
-                logger.error(f"[Exception] stage: {self.__name__}, case: {name}")
-                logger.error(traceback.format_exc())
-                raise e
-            cache.save(result)
-        else:
-            raise ValueError(f"Input Node '{self.__name__}' lacks input.")
+            duration = timing.seconds
+        except Exception as e:
+            import traceback
+            logger.error("[Exception] stage: %s, case: %s", self.__name__, name)
+            logger.error(traceback.format_exc())
+            raise e
+        with metrics.timer(self.__name__, "save") as timing:
+            if self.invalidation == "hash":
+                self._save_hash(context, cache, result, prev_args)
+            else:
+                cache.save(result)
+            timing.nbytes = cache.bytes_written
+        self._record_duration(name, duration)
         return result
 
 class Input(TaskMixin):
@@ -132,39 +417,159 @@ class Input(TaskMixin):
     def __str__(self) -> str:
         return self.__name__ + "[input]: " + datetime.fromtimestamp(self.__time__).isoformat()
 
-    def _needs_update(self, name: str, logger: Logger) -> Tuple[bool, float]:
+    def __hash__(self) -> int:
+        return hash((self.save_folder, self.__name__, self.__loader__))
+
+    def prefetch(self, names: List[str]) -> Dict[str, InputObj]:
+        """Loaders for `names` from one bulk lookup, empty if the loader has none."""
+        return self.__loader__.batch(self.save_folder, list(names)) or dict()
+
+    def _loader(self, context: CaseContext) -> InputObj:
+        """The prefetched loader of the case, else one created once per context."""
+        loaders = context.loaders.setdefault(self, dict())
+        loader = loaders.get(context.name)
+        if loader is None:
+            loader = loaders[context.name] = self.__loader__(self.save_folder, context.name)
+        return loader
+
+    def _resolve(self, context: CaseContext) -> NodeState:
+        name, logger = context.name, context.logger
         try:
-            timestamp = (max(self.__time__, self.__loader__(self.save_folder, name).time()))
+            timestamp = (max(self.__time__, self._loader(context).time()))
         except FileNotFoundError:
             timestamp = 0
         except Exception as e:
             import traceback
-            logger.error(f"[Exception] stage: {self.__name__}, case: {name}")
+            logger.error("[Exception] stage: %s, case: %s", self.__name__, name)
             logger.error(traceback.format_exc())
             raise e
-        return False, timestamp
+        return NodeState(False, timestamp, "")
+
+    def _digest(self, context: CaseContext, hint: Optional[list], value: Any = _MISSING) -> str:
+        """Input content digest. Reused from the consumer's record while the input's time is unchanged, so touched
+        but identical inputs are only hashed once."""
+        timestamp = context.resolve(self).time
+        if hint is not None and hint[0] == timestamp:
+            return hint[1]
+        digest = self._loader(context).digest(*self.extra_args)
+        if digest is None:
+            digest = content_hash(self._evaluate(context) if value is _MISSING else value)
+        return digest
 
-    def run(self, name: str, logger: Logger) -> Any:
+    def _evaluate(self, context: CaseContext) -> Any:
+        name, logger = context.name, context.logger
         try:
-            loader = self.__loader__(self.save_folder, name)
-            logger.debug(f"[Input] read input file. {self.__name__}: {name}")
-            res = loader.load(*self.extra_args)
+            loader = self._loader(context)
+            logger.debug("[Input] read input file. %s: %s", self.__name__, name)
+            with metrics.timer(self.__name__, "load"):
+                res = loader.load(*self.extra_args)
         except Exception as e:
-            logger.error(f"[Exception] input: {self.__name__}, case: {name}")
+            logger.error("[Exception] input: %s, case: %s", self.__name__, name)
             raise e
         return res
 
-def get_result(cases: list, tasks: Union[Task, List[Task]], name: str = "default") -> list:
+def prefetch(cases: list, tasks: Union[TaskMixin, List[TaskMixin]]) -> Dict[Input, Dict[str, InputObj]]:
+    """Loaders of every Input upstream of `tasks` for all `cases`, from one bulk lookup per Input whose loader
+    implements `InputObj.batch`. Pass them as `loaders` to the CaseContext of each of the cases."""
+    loaders: Dict[Input, Dict[str, InputObj]] = dict()
+    stack = [tasks] if isinstance(tasks, TaskMixin) else list(tasks)
+    visited = set()
+    while stack:
+        node = stack.pop()
+        if id(node) in visited:
+            continue
+        visited.add(id(node))
+        if isinstance(node, Input):
+            loaders[node] = node.prefetch(cases)
+        stack.extend(node.dependencies or tuple())
+    return loaders
+
+def _run_cases(job: Tuple[List[str], List[TaskMixin], Logger, Optional[float]]
+               ) -> Tuple[List[Tuple[str, List[Any]]], Metrics]:
+    cases, tasks, logger, lease_ttl = job
+    loaders = prefetch(cases, tasks)
+    results = [(case, CaseContext(case, logger, loaders=loaders, lease_ttl=lease_ttl).run(tasks)) for case in cases]
+    return results, metrics.take()
+
+class Executor(object):
+    """Worker pool for Task runs that stays warm across calls. All output tasks of a case are evaluated in one job
+    sharing a CaseContext, and results can be streamed back as cases complete.
+    Args:
+        workers: number of worker processes, by default all but 3 cores.
+        chunksize: number of cases sent to a worker at a time, by default a quarter of each worker's share of the
+            cases, so that the inputs of a chunk are looked up in bulk while the workers still balance the load.
+        lease_ttl: if set, computes hold a `Lease` on their (stage, case), see `CaseContext`. Sent with every job,
+            so it holds whatever the start method of the workers.
+    """
+    def __init__(self, workers: Optional[int] = None, chunksize: Optional[int] = None, logger: Optional[Logger] = None,
+                 lease_ttl: Optional[float] = None):
+        self.workers = workers if workers is not None else max(1, cpu_count() - 3)
+        self.chunksize = chunksize
+        self.lease_ttl = lease_ttl
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = Pool(self.workers)
+        return self._pool
+
+    def imap(self, cases: list, tasks: Union[TaskMixin, List[TaskMixin]], ordered: bool = False) -> Iterator[tuple]:
+        """Yield (case, result) as each case completes, result being a list if `tasks` is a list.
+        Cases come in completion order unless `ordered`."""
+        single = isinstance(tasks, TaskMixin)
+        task_list = [tasks] if single else list(tasks)  # type: ignore
+        cases = list(cases)
+        # a chunk of cases is one job, so that its inputs are looked up in bulk
+        chunksize = self.chunksize if self.chunksize is not None else max(1, ceil(len(cases) / (self.workers * 4)))
+        jobs = ((cases[start: start + chunksize], task_list, self.logger, self.lease_ttl)
+                for start in range(0, len(cases), chunksize))
+        imap = self.pool.imap if ordered else self.pool.imap_unordered
+        for chunk, worker_metrics in imap(_run_cases, jobs):
+            metrics.merge(worker_metrics)
+            for case, results in chunk:
+                yield case, (results[0] if single else results)
+
+    def map(self, cases: list, tasks: Union[TaskMixin, List[TaskMixin]]) -> list:
+        """Results in the order of `cases`, as a list per task if `tasks` is a list."""
+        results = [result for _, result in self.imap(cases, tasks, ordered=True)]
+        if isinstance(tasks, TaskMixin):
+            return results
+        return [[result[index] for result in results] for index in range(len(tasks))]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self) -> "Executor":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def get_result(cases: list, tasks: Union[Task, List[Task]], name: str = "default",
+               executor: Optional[Executor] = None, metrics_path: Optional[str] = None) -> list:
+    """Run `tasks` over `cases` on `executor`, by default a new one for this call, so the workers see the current
+    `save_folder` and stage functions. Pass an `executor` to keep its workers warm across calls. The stage metrics
+    of the run, from all workers, are logged, kept as `get_result.metrics` and written to `metrics_path` if given,
+    as Prometheus text for a .prom or .txt file and JSON otherwise."""
     logger = getattr(get_result, "logger", None)
     if logger is None:
         logger = getLogger(name, str(name + ".log"))
         get_result.logger = logger  # type: ignore
-    pool = Pool(max(1, cpu_count() - 3))
-    params = [(case, logger) for case in cases]
-    if isinstance(tasks, Task):
-        return pool.starmap(tasks.run, params)
+    earlier = metrics.take()  # recorded in this process before the run, kept out of its report
+    if executor is None:
+        with Executor(logger=logger) as executor:
+            results = executor.map(cases, tasks)
     else:
-        output = list()
-        for task in tasks:
-            output.append(pool.starmap(task.run, params))
-        return output
+        results = executor.map(cases, tasks)
+    run_metrics = metrics.take()
+    metrics.merge(earlier)
+    logger.info("[Metrics]\n" + run_metrics.report())
+    if metrics_path is not None:
+        run_metrics.save(metrics_path)
+    get_result.metrics = run_metrics  # type: ignore
+    return results
@@ -0,0 +1,27 @@
+"""Thread based stages with the API of `pypedream.process`, for I/O bound work that releases the GIL. Thread and
+process stages can be mixed in one pipeline. Items passed between two thread stages are not pickled."""
+from threading import Thread
+from . import process
+from .process import _QueueStatus, to_iterable
+
+__all__ = ["map", "filter", "concat", "from_iterable", "to_iterable"]
+
+def map(f, stage=_QueueStatus.UNDEFINED, workers=1, maxsize=0, ordered=False, window=64, chunksize=1, on_start=None,
+        on_done=None):
+    """Same as `pypedream.process.map`, with each worker a thread."""
+    return process.map(f, stage, workers=workers, maxsize=maxsize, ordered=ordered, window=window,
+                       chunksize=chunksize, on_start=on_start, on_done=on_done, worker_constructor=Thread)
+
+def filter(f, stage=_QueueStatus.UNDEFINED, workers=1, maxsize=0, ordered=False, window=64, chunksize=1,
+           on_start=None, on_done=None):
+    """Same as `pypedream.process.filter`, with each worker a thread."""
+    return process.filter(f, stage, workers=workers, maxsize=maxsize, ordered=ordered, window=window,
+                          chunksize=chunksize, on_start=on_start, on_done=on_done, worker_constructor=Thread)
+
+def concat(stages, maxsize=0, chunksize=1):
+    """Same as `pypedream.process.concat`, running in a thread."""
+    return process.concat(stages, maxsize=maxsize, chunksize=chunksize, worker_constructor=Thread)
+
+def from_iterable(iterable=_QueueStatus.UNDEFINED, maxsize=None, chunksize=1):
+    """Same as `pypedream.process.from_iterable`, iterating in a thread. The iterable is never pickled."""
+    return process.from_iterable(iterable, maxsize=maxsize, chunksize=chunksize, worker_constructor=Thread)
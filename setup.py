@@ -20,7 +20,8 @@ setup(
     install_requires=["multiprocessing_logging"],
     include_package_data=True,
     tests_require=["pytest", "pytest-runner"],
-    extras_require={"print": ["print-tree2"], "draw": ["pygraphviz", "networkx"]},
+    extras_require={"print": ["print-tree2"], "draw": ["pygraphviz", "networkx"], "zstd": ["zstandard"],
+                    "lz4": ["lz4"], "plan": ["pandas"]},
     description='matplotlib customizations and customized ploting functions',
     long_description=long_description
 )
@@ -0,0 +1,9 @@
+from pytest import fixture
+from pypedream import Task, Input
+
+@fixture
+def save_folder(tmp_path, monkeypatch):
+    """Point Task and Input caches at a temporary folder, restored after the test."""
+    monkeypatch.setattr(Task, "save_folder", tmp_path)
+    monkeypatch.setattr(Input, "save_folder", tmp_path)
+    return tmp_path
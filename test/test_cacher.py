@@ -0,0 +1,92 @@
+from pathlib import Path
+import logging
+import pickle as pkl
+import pytest
+from pypedream import Task, Input, InputObj, ZstdCacher, Lz4Cacher, ZlibCacher, Zip7Cacher, ArrayCacher
+from pypedream import fileobj
+
+CODECS = [(ZlibCacher, None), (ZstdCacher, fileobj.zstd), (Lz4Cacher, fileobj.lz4)]
+BIG = list(range(100000))
+
+@pytest.mark.parametrize("cacher, module", CODECS)
+def test_roundtrip(tmp_path, cacher, module):
+    if cacher is not ZlibCacher and module is None:
+        pytest.skip("compression package not installed")
+    cache = cacher(tmp_path.joinpath("stage", "case-1"))
+    assert cache.time() == 0
+    cache.save(BIG)
+    assert tmp_path.joinpath("stage", "case-1" + cacher.suffix).exists()
+    assert cache.time() > 0
+    assert cache.load() == BIG
+    small = cacher(tmp_path.joinpath("stage", "case-2"))
+    small.save({"a": 1})
+    assert tmp_path.joinpath("stage", "case-2.pkl").exists()
+    assert small.load() == {"a": 1}
+
+def test_threshold(tmp_path):
+    cache = ZlibCacher(tmp_path.joinpath("case"), level=9, threshold=1 << 30)
+    cache.save(BIG)
+    assert tmp_path.joinpath("case.pkl").exists()
+    assert cache.load() == BIG
+
+def test_large_buffer(tmp_path):
+    cache = ZlibCacher(tmp_path.joinpath("case"))
+    cache.save(bytearray(1 << 20))
+    assert cache.load() == bytearray(1 << 20)
+
+def test_legacy_pickle(tmp_path):
+    with open(tmp_path.joinpath("case.pkl"), 'wb') as bfp:
+        pkl.dump(BIG, bfp)
+    assert ZlibCacher(tmp_path.joinpath("case")).load() == BIG
+
+class ValueInput(InputObj):
+    def load(self, *args):
+        return list(range(int(self.name)))
+
+    def time(self) -> float:
+        return 1.0
+
+def total(x):
+    return x
+
+def test_cacher_options(save_folder):
+    task = Task(total, "2019-04-26T17:12", file_cacher=ZlibCacher, cacher_options={"threshold": 10})
+    task(Input(ValueInput, "2019-04-26T17:12"))
+    assert task.run("100", logging.getLogger("pypedream-test")) == list(range(100))
+    assert save_folder.joinpath("total", "100.gz").exists()
+    assert task.cacher("100").load() == list(range(100))
+
+def _hammer(args):
+    cacher, folder, index, size = args
+    cache = cacher(Path(folder).joinpath("shared"))
+    for _ in range(20):
+        cache.save([index] * size)
+        value = cache.load()
+        assert len(value) == size and len(set(value)) == 1
+    return True
+
+@pytest.mark.parametrize("cacher", [Zip7Cacher, ZlibCacher])
+def test_concurrent_save_load(tmp_path, cacher):
+    from multiprocessing import Pool
+    from shutil import which
+    size = 50000 if cacher is Zip7Cacher and which("7z") is None else 150000  # past the threshold if possible
+    with Pool(4) as pool:
+        assert all(pool.map(_hammer, [(cacher, str(tmp_path), index, size) for index in range(8)]))
+    assert not any(entry.name.startswith(".") for entry in tmp_path.iterdir())
+
+def test_array_cacher(tmp_path):
+    np = pytest.importorskip("numpy")
+    obj = {"image": np.arange(100000, dtype=np.float32).reshape(100, 1000), "pair": (np.ones(3)[::2], [np.zeros(0)]),
+           "label": "a"}
+    cache = ArrayCacher(tmp_path.joinpath("case"))
+    cache.save(obj)
+    assert tmp_path.joinpath("case.npk").exists()
+    result = cache.load()
+    assert np.array_equal(result["image"], obj["image"]) and result["image"].dtype == np.float32
+    assert not result["image"].flags.writeable
+    assert np.array_equal(result["pair"][0], [1, 1]) and result["pair"][1][0].size == 0
+    assert result["label"] == "a"
+    bare = ArrayCacher(tmp_path.joinpath("bare"))
+    bare.save(obj["image"])
+    assert isinstance(bare.load(), np.memmap)
+    assert np.array_equal(bare.load()[50], obj["image"][50])
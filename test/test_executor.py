@@ -0,0 +1,51 @@
+from typing import Any
+from os import getpid
+import logging
+from pypedream import Task, Input, InputObj, Executor, ZlibCacher, get_result
+
+logger = logging.getLogger("pypedream-test")
+
+class NumberInput(InputObj):
+    def load(self, *args) -> Any:
+        return int(self.name)
+
+    def time(self) -> float:
+        return 1.0
+
+def square(x):
+    return x * x
+
+def pid(x):
+    return getpid()
+
+def build():
+    source = Input(NumberInput, "2019-04-26T17:12")
+    s1 = Task(square, "2019-04-26T17:12", file_cacher=ZlibCacher)(source)
+    s2 = Task(pid, "2019-04-26T17:12", file_cacher=ZlibCacher)(s1)
+    return s1, s2
+
+def test_executor(save_folder):
+    s1, s2 = build()
+    cases = [str(x) for x in range(20)]
+    with Executor(workers=2, chunksize=3, logger=logger) as executor:
+        assert executor.map(cases, s1) == [x * x for x in range(20)]
+        pool = executor.pool
+        streamed = dict(executor.imap(cases, [s1, s2]))
+        assert executor.pool is pool
+        assert sorted(streamed) == sorted(cases)
+        assert all(streamed[str(x)][0] == x * x for x in range(20))
+        squares, pids = executor.map(cases, [s1, s2])
+        assert squares == [x * x for x in range(20)]
+        assert len(set(pids)) <= 2 and getpid() not in pids
+    assert executor._pool is None
+
+def test_get_result_folder(save_folder, tmp_path, monkeypatch):
+    s1, _ = build()
+    cases = [str(x) for x in range(4)]
+    assert get_result(cases, s1, str(tmp_path.joinpath("run"))) == [x * x for x in range(4)]
+    assert len(list(save_folder.joinpath("square").glob("*.pkl"))) == 4
+    other = tmp_path.joinpath("other")
+    monkeypatch.setattr(Task, "save_folder", other)
+    monkeypatch.setattr(Input, "save_folder", other)
+    assert get_result(cases, s1, str(tmp_path.joinpath("run"))) == [x * x for x in range(4)]
+    assert len(list(other.joinpath("square").glob("*.pkl"))) == 4
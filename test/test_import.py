@@ -0,0 +1,53 @@
+from typing import Dict, Set
+import subprocess
+import sys
+import pypedream
+
+HEAVY = ("pkg_resources", "networkx", "numpy", "pandas", "multiprocessing_logging")
+
+def import_times(statement: str) -> Dict[str, int]:
+    """Cumulative import time in us of every module imported by `statement`, from `python -X importtime`."""
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True,
+                            check=True).stderr
+    times = dict()
+    for line in output.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+def imported(statement: str) -> Set[str]:
+    """Modules loaded after `statement`, which `-X importtime` misses for those loaded by `import_module`."""
+    output = subprocess.run([sys.executable, "-c", statement + "\nimport sys\nprint(' '.join(sys.modules))"],
+                            capture_output=True, text=True, check=True).stdout
+    return set(output.split())
+
+def test_import_time():
+    times = import_times("import pypedream")
+    assert "pypedream.task" not in times and "pypedream.process" not in times
+    assert not [name for name in times if name.split(".")[0] in HEAVY]
+    assert times["pypedream"] < 200000
+    modules = imported("from pypedream import Task, Executor, getLogger")
+    assert "pypedream.task" in modules and "pypedream.plotter" not in modules
+    assert not [name for name in modules if name.split(".")[0] in HEAVY]
+
+def test_no_processes_on_import():
+    subprocess.run([sys.executable, "-c", "import multiprocessing as mp\n"
+                    "from multiprocessing import resource_tracker\n"
+                    "from pypedream import Task, Executor, process, getLogger\n"
+                    "Executor(workers=2)\n"
+                    "assert not mp.active_children()\n"
+                    "assert resource_tracker._resource_tracker._pid is None\n"], check=True)
+
+def test_lazy_names():
+    assert set(pypedream.__all__) <= set(dir(pypedream))
+    from pypedream.task import Task
+    assert pypedream.Task is Task
+    assert pypedream.process.map is not None
+    try:
+        pypedream.missing
+    except AttributeError:
+        pass
+    else:
+        assert False
@@ -0,0 +1,25 @@
+import pickle as pkl
+import subprocess as sp
+import sys
+from pypedream import CacheIndex, ZlibCacher, Zip7Cacher
+
+def test_indexed_cacher(tmp_path):
+    cache = ZlibCacher(tmp_path.joinpath("case-1"), index=True)
+    assert cache.time() == 0
+    cache.save([1, 2, 3])
+    entry = CacheIndex(tmp_path).get("case-1")
+    assert entry.file == "case-1.pkl" and entry.format == "pkl" and entry.size > 0
+    assert cache.time() == entry.mtime == tmp_path.joinpath("case-1.pkl").stat().st_mtime
+    assert cache.load() == [1, 2, 3]
+    with open(tmp_path.joinpath("case-2.pkl"), 'wb') as bfp:  # out-of-band
+        pkl.dump("b", bfp)
+    assert ZlibCacher(tmp_path.joinpath("case-2"), index=True).time() == 0
+    assert ZlibCacher(tmp_path.joinpath("case-2")).load() == "b"
+
+def test_rebuild(tmp_path):
+    for name in ("case-1", "case-2"):
+        Zip7Cacher(tmp_path.joinpath(name)).save(name)
+    assert CacheIndex(tmp_path).get("case-1") is None
+    sp.run([sys.executable, "-m", "pypedream.index", "rebuild", str(tmp_path)], check=True)
+    assert Zip7Cacher(tmp_path.joinpath("case-2"), index=True).load() == "case-2"
+    assert CacheIndex(tmp_path).get("case-1").file == "case-1.pkl"
@@ -0,0 +1,48 @@
+from multiprocessing import Pool
+import logging
+from pypedream import getLogger
+from pypedream import logger as logger_module
+
+def log_case(name):
+    logging.getLogger("pypedream-log-test").info("[Case] %s", name)
+    return name
+
+def _reset():
+    logger_module._stop_listeners()
+    logger_module._configured.clear()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+
+def test_worker_mode(tmp_path):
+    log_path = tmp_path.joinpath("run.log")
+    try:
+        logger = getLogger("pypedream-log-test", str(log_path), level="INFO", mode="worker")
+        assert getLogger("pypedream-log-test", str(log_path), level="INFO", mode="worker") is logger
+        pool = Pool(2)
+        assert pool.map(log_case, [str(x) for x in range(20)], chunksize=1) == [str(x) for x in range(20)]
+        pool.close()
+        pool.join()  # workers write their buffers when they exit
+        logger.debug("not written below INFO")
+    finally:
+        _reset()
+    files = list(tmp_path.glob("run.*.log"))
+    assert 1 <= len(files) <= 2
+    lines = [line for file in files for line in file.read_text().splitlines()]
+    assert sorted(line.rsplit(" ", 1)[1] for line in lines) == sorted(str(x) for x in range(20))
+
+def test_queue_mode(tmp_path):
+    log_path = tmp_path.joinpath("run.log")
+    try:
+        logger = getLogger("pypedream-log-test", str(log_path), mode="queue")
+        pool = Pool(2)
+        pool.map(log_case, [str(x) for x in range(20)])
+        pool.close()
+        pool.join()
+        logger.debug("[Parent] done")
+    finally:
+        _reset()  # stops the listener after it has handled every queued record
+    lines = log_path.read_text().splitlines()
+    assert sum("[Case]" in line for line in lines) == 20
+    assert "[Parent] done" in lines[-1]
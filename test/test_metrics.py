@@ -0,0 +1,73 @@
+from typing import Any
+import json
+import logging
+from pypedream import Task, Input, InputObj, Executor, Scheduler, ZlibCacher, Metrics, CaseContext, get_result
+from pypedream.metrics import metrics
+
+logger = logging.getLogger("pypedream-test")
+
+class NumberInput(InputObj):
+    def load(self, *args) -> Any:
+        return int(self.name)
+
+    def time(self) -> float:
+        return 1.0
+
+def square(x):
+    return x * x
+
+def halve(x):
+    return x / 2
+
+def build():
+    source = Input(NumberInput, "2019-04-26T17:12")
+    s1 = Task(square, "2019-04-26T17:12", file_cacher=ZlibCacher)(source)
+    s2 = Task(halve, "2019-04-26T17:12", file_cacher=ZlibCacher)(s1)
+    return s1, s2
+
+def test_metrics(save_folder):
+    s1, s2 = build()
+    cases = [str(x) for x in range(10)]
+    metrics.take()
+    with Executor(workers=2, chunksize=3, logger=logger) as executor:
+        executor.map(cases, s2)  # all misses, recorded in the workers
+        summary = metrics.take().summary()
+        assert summary["square"]["misses"] == 10 and summary["square"]["hits"] == 0
+        assert summary["square"]["save_bytes"] > 0 and summary["square"]["compute_count"] == 10
+        assert summary["NumberInput"]["load_count"] == 10
+        executor.map(cases, s2)  # s2 is loaded, s1 only checked
+        summary = metrics.take().summary()
+        assert summary["halve"]["hits"] == 10 and summary["halve"]["hit_rate"] == 1.0
+        assert summary["halve"]["load_bytes"] > 0
+        assert summary["square"]["check_count"] == 10 and summary["square"]["load_count"] == 0
+    Scheduler(workers=2).run(cases, s2)
+    assert metrics.take().summary()["halve"]["check_count"] == 10
+
+def test_get_result_metrics(save_folder, tmp_path):
+    s1, s2 = build()
+    cases = [str(x) for x in range(4)]
+    name = str(tmp_path.joinpath("run"))  # the log file, unless an earlier test set up the logger
+    with Executor(workers=2, logger=logger) as executor:
+        get_result(cases, s2, name, executor, metrics_path=str(tmp_path.joinpath("metrics.json")))
+        get_result(cases, s2, name, executor, metrics_path=str(tmp_path.joinpath("metrics.prom")))
+    report = json.loads(tmp_path.joinpath("metrics.json").read_text())
+    assert report["halve"]["misses"] == 4
+    assert 'pypedream_calls_total{stage="halve",kind="load"} 4' in tmp_path.joinpath("metrics.prom").read_text()
+    assert get_result.metrics.summary()["halve"]["hits"] == 4
+
+def test_get_result_earlier(save_folder, tmp_path):
+    _, s2 = build()
+    CaseContext("9", logger).resolve(s2)  # checks in this process before the run
+    assert metrics.summary()["halve"]["check_count"] >= 1
+    with Executor(workers=1, logger=logger) as executor:
+        get_result(["1"], s2, str(tmp_path.joinpath("run")), executor)
+    assert get_result.metrics.summary()["halve"]["check_count"] == 1
+    assert metrics.summary()["halve"]["check_count"] >= 1  # still there for whoever recorded it
+    metrics.take()
+
+def test_nested_timers():
+    recorded = Metrics()
+    with recorded.timer("outer", "check"):
+        with recorded.timer("inner", "compute") as timing:
+            sum(range(100000))
+    assert recorded.stages["outer"]["check"][1] < timing.seconds
@@ -0,0 +1,229 @@
+from typing import Any
+from collections import Counter
+import logging
+import os
+import pickle as pkl
+from pypedream import Task, Input, FileObj, InputObj, CaseContext, Executor, Scheduler, plan
+
+logger = logging.getLogger("pypedream-test")
+TIME_CALLS: Counter = Counter()
+RUN_CALLS: Counter = Counter()
+
+class CountingCacher(FileObj):
+    def time(self) -> float:
+        TIME_CALLS[self.file_path.parent.name] += 1
+        return self.file_path.with_suffix(".pkl").stat().st_mtime if self.file_path.with_suffix(".pkl").exists() else 0
+
+    def load(self) -> Any:
+        with open(self.file_path.with_suffix(".pkl"), 'rb') as bfp:
+            return pkl.load(bfp)
+
+    def save(self, obj: Any):
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.file_path.with_suffix(".pkl"), 'wb') as bfp:
+            pkl.dump(obj, bfp)
+
+class NumberInput(InputObj):
+    def load(self, *args) -> Any:
+        return int(self.name)
+
+    def time(self) -> float:
+        TIME_CALLS["input"] += 1
+        return 1.0
+
+def _counted(fn):
+    def wrapper(*args):
+        RUN_CALLS[fn.__name__] += 1
+        return fn(*args)
+    wrapper.__name__ = fn.__name__
+    return wrapper
+
+@_counted
+def double(x):
+    return x * 2
+
+@_counted
+def add(x, y):
+    return x + y
+
+@_counted
+def inc(x):
+    return x + 1
+
+@_counted
+def merge(x, y):
+    return (x, y)
+
+def build():
+    """diamond: merge <- (add, inc) <- double <- input"""
+    source = Input(NumberInput, "2019-04-26T17:12")
+    s2 = Task(double, "2019-04-26T17:12", file_cacher=CountingCacher)(source)
+    s4 = Task(add, "2019-04-26T17:12", file_cacher=CountingCacher)([s2, source])
+    s5 = Task(inc, "2019-04-26T17:12", file_cacher=CountingCacher)(s2)
+    return Task(merge, "2019-04-26T17:12", file_cacher=CountingCacher)([s4, s5])
+
+def test_single_pass_resolution(save_folder):
+    s6 = build()
+    TIME_CALLS.clear()
+    assert s6.run("3", logger) == (9, 7)
+    assert all(count == 1 for count in TIME_CALLS.values()), TIME_CALLS
+    TIME_CALLS.clear()
+    context = CaseContext("3", logger)
+    assert s6.run("3", logger, context) == (9, 7)
+    assert all(count == 1 for count in TIME_CALLS.values()), TIME_CALLS
+
+def test_stale_reason(save_folder):
+    s6 = build()
+    s6.run("4", logger)
+    s2 = s6.dependencies[1].dependencies[0]
+    save_folder.joinpath("double", "4.pkl").unlink()
+    context = CaseContext("4", logger)
+    assert context.resolve(s6) == (True, 0, "dependency")
+    assert context.states[s2].reason == "missing"
+
+def test_shared_results(save_folder):
+    s6 = build()
+    RUN_CALLS.clear()
+    context = CaseContext("5", logger)
+    assert s6.run("5", logger, context) == (15, 11)
+    assert set(RUN_CALLS.values()) == {1}
+    assert len(context.results) == 0
+    context = CaseContext("5", logger)
+    s6.run("5", logger, context)
+    assert not any(state.stale for state in context.states.values())
+
+def test_multiple_outputs(save_folder):
+    s6 = build()
+    s4 = s6.dependencies[0]
+    RUN_CALLS.clear()
+    context = CaseContext("6", logger)
+    assert context.run([s4, s6]) == [18, (18, 13)]
+    assert set(RUN_CALLS.values()) == {1}
+    assert len(context.results) == 0
+
+class FileInput(InputObj):
+    def load(self, *args) -> Any:
+        return int(self.file_path.joinpath("source", self.name).read_text())
+
+    def time(self) -> float:
+        return self.file_path.joinpath("source", self.name).stat().st_mtime
+
+@_counted
+def parity(x):
+    return x % 2
+
+@_counted
+def label(x):
+    return "odd" if x else "even"
+
+def test_hash_invalidation(save_folder):
+    import os
+    source = save_folder.joinpath("source")
+    source.mkdir()
+    source.joinpath("7").write_text("7")
+    s1 = Task(parity, "2019-04-26T17:12", file_cacher=CountingCacher, invalidation="hash")
+    s1(Input(FileInput, "2019-04-26T17:12"))
+    s2 = Task(label, "2019-04-26T17:12", file_cacher=CountingCacher, invalidation="hash")(s1)
+    RUN_CALLS.clear()
+    assert s2.run("7", logger) == "odd"
+    assert RUN_CALLS == {"parity": 1, "label": 1}
+    os.utime(source.joinpath("7"), (1e9, 2e9))  # touched, same content
+    assert s2.run("7", logger) == "odd"
+    assert RUN_CALLS == {"parity": 1, "label": 1}
+    source.joinpath("7").write_text("9")  # changed, same parity
+    assert s2.run("7", logger) == "odd"
+    assert RUN_CALLS == {"parity": 2, "label": 1}
+    assert not CaseContext("7", logger).resolve(s2).stale
+    source.joinpath("7").write_text("8")
+    assert s2.run("7", logger) == "even"
+    assert RUN_CALLS == {"parity": 3, "label": 2}
+
+def add3(x, k=3):
+    return x + k
+
+def add4(x, k=4):
+    return x + k
+
+class Scale(object):
+    def __init__(self, factor):
+        self.factor = factor
+
+    def __call__(self, x):
+        return x * self.factor
+
+def test_fingerprint():
+    import subprocess
+    import sys
+    from functools import partial
+    from pypedream.task import _fingerprint
+    assert _fingerprint(add3) != _fingerprint(add4)  # same code, different defaults
+    assert _fingerprint(partial(add3, k=1)) != _fingerprint(partial(add3, k=2))
+    assert _fingerprint(Scale(2)) == _fingerprint(Scale(2)) != _fingerprint(Scale(3))
+    script = "from functools import partial\nfrom pypedream.task import _fingerprint\n" \
+             "print(_fingerprint(partial(int, base=2)), _fingerprint(len))"
+    runs = {subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+            for _ in range(2)}
+    assert len(runs) == 1  # no memory address in the key
+
+class ListedInput(InputObj):
+    """Reads source/<name>, finding the files of all cases with one listing of the folder."""
+    def __init__(self, data_folder, name, entry=None):
+        super().__init__(data_folder, name)
+        self.entry = entry
+
+    @classmethod
+    def batch(cls, data_folder, names):
+        TIME_CALLS["listing"] += 1
+        entries = {entry.name: entry for entry in os.scandir(data_folder.joinpath("source"))}
+        return {name: cls(data_folder, name, entries.get(name)) for name in names}
+
+    def load(self, *args) -> Any:
+        return int(self.file_path.joinpath("source", self.name).read_text())
+
+    def time(self) -> float:
+        TIME_CALLS["input"] += 1
+        if self.entry is None:
+            return self.file_path.joinpath("source", self.name).stat().st_mtime
+        return self.entry.stat().st_mtime
+
+def negate(x):
+    return -x
+
+def test_prefetch(save_folder):
+    source = save_folder.joinpath("source")
+    source.mkdir()
+    cases = [str(x) for x in range(10)]
+    for case in cases:
+        source.joinpath(case).write_text(case)
+    s1 = Task(double, "2019-04-26T17:12", file_cacher=CountingCacher)(Input(ListedInput, "2019-04-26T17:12"))
+    s2 = Task(inc, "2019-04-26T17:12", file_cacher=CountingCacher)(s1)
+    TIME_CALLS.clear()
+    assert Scheduler(workers=2, backend="thread").run(cases, s2, collect=True) == [x * 2 + 1 for x in range(10)]
+    assert TIME_CALLS["listing"] == 2  # planning and collecting, not a listing per case
+    TIME_CALLS.clear()
+    rows = plan(cases, s2, workers=1, as_frame=False)
+    assert not any(row["stale"] for row in rows)
+    assert TIME_CALLS["listing"] == 1 and TIME_CALLS["input"] == 10
+    s3 = Task(negate, "2019-04-26T17:12", file_cacher=CountingCacher)(Input(ListedInput, "2019-04-26T17:12"))
+    with Executor(workers=2, chunksize=5) as executor:
+        assert executor.map(cases, s3) == [-x for x in range(10)]
+
+class LoggedListedInput(ListedInput):
+    """Leaves a file per bulk lookup, which also counts the lookups of worker processes."""
+    @classmethod
+    def batch(cls, data_folder, names):
+        data_folder.joinpath("batches").mkdir(exist_ok=True)
+        data_folder.joinpath("batches", names[0]).touch()
+        return super().batch(data_folder, names)
+
+def test_prefetch_get_result(save_folder, tmp_path):
+    from pypedream import get_result
+    source = save_folder.joinpath("source")
+    source.mkdir()
+    cases = [str(x) for x in range(50)]
+    for case in cases:
+        source.joinpath(case).write_text(case)
+    s1 = Task(negate, "2019-04-26T17:12", file_cacher=CountingCacher)(Input(LoggedListedInput, "2019-04-26T17:12"))
+    assert get_result(cases, s1, str(tmp_path.joinpath("run"))) == [-x for x in range(50)]
+    batches = len(list(save_folder.joinpath("batches").iterdir()))
+    assert batches <= min(50, Executor().workers * 4)
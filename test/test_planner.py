@@ -0,0 +1,68 @@
+from typing import Any
+import logging
+import sys
+from pypedream import Task, Input, InputObj, ZlibCacher, plan
+from pypedream import planner
+from pypedream import task as task_module
+
+logger = logging.getLogger("pypedream-test")
+
+class NumberInput(InputObj):
+    def load(self, *args) -> Any:
+        return int(self.name)
+
+    def time(self) -> float:
+        return 1.0
+
+def double(x):
+    return x * 2
+
+def inc(x):
+    return x + 1
+
+source = Input(NumberInput, "2019-04-26T17:12")
+s1 = Task(double, "2019-04-26T17:12", file_cacher=ZlibCacher)(source)
+s2 = Task(inc, "2019-04-26T17:12", file_cacher=ZlibCacher)(s1)
+
+def test_plan(save_folder):
+    rows = plan(["1", "2"], s2, workers=1, logger=logger, as_frame=False)
+    assert sorted((row["stage"], row["case"], row["reason"]) for row in rows) == [
+        ("double", "1", "missing"), ("double", "2", "missing"), ("inc", "1", "dependency"), ("inc", "2", "dependency")]
+    assert all(row["stale"] and row["projected"] is None for row in rows)
+    s2.run("1", logger)
+    assert len(s1.durations()) == 1
+    save_folder.joinpath("inc", "1.pkl").unlink()
+    rows = plan(["1", "2", "3"], [s2], workers=2, logger=logger, as_frame=False)
+    stale = {(row["stage"], row["case"]): row for row in rows if row["stale"]}
+    assert sorted(stale) == [("double", "2"), ("double", "3"), ("inc", "1"), ("inc", "2"), ("inc", "3")]
+    assert stale[("inc", "1")]["reason"] == "missing"
+    assert isinstance(stale[("double", "2")]["projected"], float)
+    summary = planner.summarize(rows)
+    assert summary["double"]["stale"] == 2 and summary["inc"]["reasons"] == {"missing": 1, "dependency": 2}
+
+def test_durations(save_folder, monkeypatch):
+    monkeypatch.setattr(task_module, "DURATION_LIMIT", 5)
+    path = s1.path().joinpath(task_module.DURATION_FILE)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("1\t0.5\n2\t0.\n3")  # torn append of a crashed worker
+    assert s1.durations() == [0.5, 0.]
+    for x in range(30):
+        s1._record_duration(str(x), float(x))
+    assert len(path.read_text().splitlines()) <= 20
+    assert s1.durations(5) == [25., 26., 27., 28., 29.]
+
+def test_plan_hash(save_folder):
+    h1 = Task(double, "2019-04-26T17:12", name="double_h", file_cacher=ZlibCacher, invalidation="hash")(source)
+    h2 = Task(inc, "2019-04-26T17:12", name="inc_h", file_cacher=ZlibCacher, invalidation="hash")(h1)
+    rows = plan(["1", "2"], h2, workers=1, logger=logger, as_frame=False)
+    assert sorted((row["stage"], row["case"], row["reason"]) for row in rows) == [
+        ("double_h", "1", "missing"), ("double_h", "2", "missing"), ("inc_h", "1", "missing"),
+        ("inc_h", "2", "missing")]
+
+def test_cli(save_folder, monkeypatch, capsys):
+    save_folder.joinpath("cases.txt").write_text("1\n2\n")
+    monkeypatch.setattr(sys, "argv", ["planner", f"{__name__}:s2", "--cases", str(save_folder.joinpath("cases.txt")),
+                                      "--workers", "1", "--output", str(save_folder.joinpath("plan.csv"))])
+    planner.main()
+    assert "inc: 2/2 stale (dependency: 2), projected unknown" in capsys.readouterr().out
+    assert len(save_folder.joinpath("plan.csv").read_text().splitlines()) == 5
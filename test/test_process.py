@@ -0,0 +1,196 @@
+import gc
+import os
+from resource import getrusage, RUSAGE_CHILDREN
+from time import perf_counter, sleep
+import pytest
+from pypedream import process as pr, Task, Input, InputObj, ZlibCacher
+
+def add1(x):
+    return x + 1
+
+def fail_on_5(x):
+    if x == 5:
+        raise ValueError("five")
+    return x
+
+def slow_source(count):
+    for x in range(count):
+        sleep(0.05)
+        yield x
+
+def test_map_filter():
+    stage = range(100) | pr.map(add1, workers=3) | pr.filter(lambda x: x % 2 == 0, workers=2)
+    assert sorted(stage) == list(range(2, 101, 2))
+
+def test_error():
+    with pytest.raises(ValueError):
+        list(range(10) | pr.map(fail_on_5, workers=2) | pr.map(add1, workers=2))
+
+def test_idle_workers_block():
+    usage = getrusage(RUSAGE_CHILDREN)
+    start = perf_counter()
+    assert sorted(slow_source(20) | pr.map(add1, workers=4) | pr.map(add1, workers=4)) == list(range(2, 22))
+    elapsed = perf_counter() - start
+    usage_end = getrusage(RUSAGE_CHILDREN)
+    cpu = usage_end.ru_utime + usage_end.ru_stime - usage.ru_utime - usage.ru_stime
+    assert cpu / elapsed < 0.5
+
+def slow_first(x):
+    if x == 0:
+        sleep(0.3)
+    return x * 2
+
+def test_ordered():
+    assert list(range(50) | pr.map(slow_first, workers=4, ordered=True, window=4)) == list(range(0, 100, 2))
+    stage = (3, 1, 4, 1, 5, 9, 2, 6) | pr.filter(lambda x: x % 2 == 1, workers=3, ordered=True, window=2)
+    assert list(stage) == [3, 1, 1, 5, 9]
+
+def test_ordered_error():
+    with pytest.raises(ValueError):
+        list(range(10) | pr.map(fail_on_5, workers=2, ordered=True, window=2))
+
+def test_chunksize():
+    for chunksize in (1, 7, 64):
+        stage = range(100) | pr.map(add1, workers=3, chunksize=chunksize)
+        stage = pr.concat([stage, range(5)], chunksize=chunksize) | pr.filter(lambda x: x % 2 == 0, chunksize=chunksize)
+        assert sorted(stage) == sorted(list(range(2, 101, 2)) + [0, 2, 4])
+        stage = range(100) | pr.map(slow_first, workers=3, ordered=True, window=8, chunksize=chunksize)
+        assert list(stage) == list(range(0, 200, 2))
+
+def test_chunksize_slow_source():
+    start = perf_counter()
+    stage = pr.from_iterable(slow_source(6), chunksize=2) | pr.map(add1, workers=2, chunksize=64)
+    first = next(iter(stage))
+    assert first in (1, 2) and perf_counter() - start < 0.5
+
+def test_worker_hooks(tmp_path):
+    def on_start():
+        return os.getpid(), object()
+
+    def tag(x, pid, resource):
+        return pid, id(resource)
+
+    def on_done(status, pid, resource):
+        tmp_path.joinpath(str(pid)).write_text(str(status.active_workers))
+
+    stage = range(40) | pr.map(tag, workers=3, on_start=on_start, on_done=on_done)
+    resources = set(stage)
+    assert len(resources) <= 3 and len({pid for pid, _ in resources}) == len(resources)
+    assert sorted(int(f.read_text()) for f in tmp_path.iterdir()) == [0, 1, 2]
+
+def test_on_start_error():
+    def on_start():
+        raise ValueError("no resource")
+    with pytest.raises(ValueError):
+        list(range(10) | pr.filter(bool, workers=2, on_start=on_start))
+
+def slow_add1(x):
+    sleep(0.01)
+    return x + 1
+
+def test_budget_and_depths():
+    pipeline = pr.to_iterable(range(100) | pr.map(slow_add1, workers=2), budget=20)
+    first = next(pipeline)
+    sleep(0.3)
+    depths = pipeline.depths()
+    assert set(depths) == {"map(slow_add1)", "output"}
+    waiting, maxsize = depths["map(slow_add1)"]
+    assert maxsize == 10 and waiting in (None, 9, 10)
+    assert sorted([first] + list(pipeline)) == list(range(1, 101))
+
+def test_from_iterable_maxsize():
+    pipeline = iter(pr.from_iterable(range(1000), maxsize=3) | pr.map(slow_add1))
+    next(pipeline)
+    sleep(0.2)
+    assert pipeline.depths()["map(slow_add1)"][1] == 3
+    for _ in pipeline:  # early exit stops the blocked producer
+        break
+
+class NumberInput(InputObj):
+    def load(self, *args):
+        return int(self.name)
+
+    def time(self) -> float:
+        return 1.0
+
+def slow_square(x):
+    sleep(0.5)
+    return x * x
+
+def test_task_map(save_folder):
+    task = Task(slow_square, "2019-04-26T17:12", file_cacher=ZlibCacher)(Input(NumberInput, "2019-04-26T17:12"))
+    warm = [str(x) for x in range(6)]
+    assert sorted(warm | pr.task_map(task, workers=6)) == [(case, int(case) ** 2) for case in warm]
+    start = perf_counter()
+    results = []
+    for case, result in [str(x) for x in range(8)] | pr.task_map(task, workers=2, hit_workers=2):
+        results.append((case, result, perf_counter() - start))
+    assert sorted((case, result) for case, result, _ in results) == [(str(x), x * x) for x in range(8)]
+    assert sorted(case for case, _, _ in results[:6]) == warm  # hits don't wait for the 0.5 s misses
+
+def test_task_map_maxsize(save_folder):
+    task = Task(slow_square, "2019-04-26T17:12", file_cacher=ZlibCacher)(Input(NumberInput, "2019-04-26T17:12"))
+    warm = [str(x) for x in range(100, 106)]
+    list(warm | pr.task_map(task, workers=6))
+    start = perf_counter()
+    arrivals = dict()
+    for case, _ in [str(x) for x in range(6)] + warm | pr.task_map(task, workers=1, maxsize=2):
+        arrivals[case] = perf_counter() - start
+    assert max(arrivals[case] for case in warm) < 1.  # the router is not held up by the full queue of misses
+
+def pid(x):
+    return os.getpid()
+
+def test_close():
+    with pr.to_iterable(range(10 ** 7) | pr.map(add1, workers=2, maxsize=10)) as pipeline:
+        assert next(pipeline) in (1, 2)
+        workers = pipeline._workers
+    start = perf_counter()
+    assert not any(p.is_alive() for p in workers)
+    pipeline.close()  # closing again does nothing
+    assert perf_counter() - start < 0.5
+    pipeline = iter(range(100) | pr.map(slow_add1))
+    next(pipeline)
+    start = perf_counter()
+    pipeline.close(timeout=0.2)  # terminates the worker busy in its call
+    assert perf_counter() - start < 1.0
+    assert not any(p.is_alive() for p in pipeline._workers)
+    assert list(pipeline) == []
+
+def test_worker_pool():
+    with pr.WorkerPool(3) as pool:
+        pool_pids = {p.pid for p in pool._processes}
+        for _ in range(3):
+            assert sorted(pr.to_iterable(range(20) | pr.map(add1, workers=2), pool=pool)) == list(range(1, 21))
+        assert set(pr.to_iterable(range(20) | pr.map(pid, workers=2), pool=pool)) <= pool_pids
+        assert list(pr.to_iterable(range(20) | pr.map(add1, ordered=True), pool=pool)) == list(range(1, 21))
+        with pytest.raises(ValueError):
+            list(pr.to_iterable(range(10) | pr.map(fail_on_5, workers=2), pool=pool))
+        pipeline = pr.to_iterable(range(10 ** 6) | pr.map(add1), pool=pool)
+        with pytest.raises(RuntimeError):  # one pipeline at a time
+            pr.to_iterable(range(10) | pr.map(add1), pool=pool)
+        next(pipeline)
+        pipeline.close()
+        with pytest.raises(ValueError):  # more process workers than the pool
+            pr.to_iterable(range(10) | pr.map(add1, workers=3), pool=pool)
+        assert sorted(pr.to_iterable(range(20) | pr.map(add1, workers=2), pool=pool)) == list(range(1, 21))
+
+def halves(x):
+    return {"low": x[:50], "high": [x[50:], x.sum()]}
+
+def test_shared_memory():
+    np = pytest.importorskip("numpy")
+    blocks = set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+    arrays = [np.full(100, x, dtype=np.int64) for x in range(20)]
+    stage = arrays | pr.map(halves, workers=2, chunksize=4)
+    results = sorted(pr.to_iterable(stage, shared_memory=100), key=lambda result: result["high"][1])
+    assert [int(result["low"][0]) for result in results] == list(range(20))
+    assert all(result["high"][0].shape == (50, ) for result in results)
+    results[0]["low"][0] = -1  # backed by the writable block
+    view = results[0]["low"][10:]
+    del results
+    gc.collect()
+    view[0] = 1  # a view keeps the mapping open
+    del view
+    if os.path.isdir("/dev/shm"):
+        assert set(os.listdir("/dev/shm")) == blocks
@@ -0,0 +1,61 @@
+from typing import Any
+from time import perf_counter, sleep
+import logging
+import pytest
+from pypedream import Task, Input, InputObj, Scheduler, ZlibCacher
+
+logger = logging.getLogger("pypedream-test")
+
+class NumberInput(InputObj):
+    def load(self, *args) -> Any:
+        return int(self.name)
+
+    def time(self) -> float:
+        return 1.0
+
+def slow_double(x):
+    sleep(0.3)
+    return x * 2
+
+def slow_triple(x):
+    sleep(0.3)
+    return x * 3
+
+def total(x, y):
+    return x + y
+
+def build():
+    source = Input(NumberInput, "2019-04-26T17:12")
+    s2 = Task(slow_double, "2019-04-26T17:12", file_cacher=ZlibCacher)(source)
+    s3 = Task(slow_triple, "2019-04-26T17:12", file_cacher=ZlibCacher)(source)
+    return Task(total, "2019-04-26T17:12", file_cacher=ZlibCacher)([s2, s3])
+
+def test_parallel_branches(save_folder):
+    s4 = build()
+    start = perf_counter()
+    assert Scheduler(workers=2, backend="thread", logger=logger).run(["1"], s4, collect=True) == [5]
+    assert perf_counter() - start < 0.55
+    assert Scheduler(workers=2, backend="thread", logger=logger).plan(["1"], s4) == {}
+    start = perf_counter()
+    assert Scheduler(workers=2, backend="thread", logger=logger).run(["1"], s4, collect=True) == [5]
+    assert perf_counter() - start < 0.2
+
+def test_stage_limits(save_folder):
+    s4 = build()
+    scheduler = Scheduler(workers=4, backend="thread", limits={"slow_double": 1}, logger=logger)
+    start = perf_counter()
+    scheduler.run(["1", "2", "3"], s4)
+    assert perf_counter() - start > 0.85
+    assert scheduler.run(["1", "2", "3"], [s4, s4.dependencies[0]], collect=True) == [[5, 10, 15], [2, 4, 6]]
+    with pytest.raises(ValueError):
+        Scheduler(workers=4, backend="thread", limits={"slow_double": 0}, logger=logger)
+
+def fail(x):
+    raise ValueError("boom")
+
+def test_process_backend(save_folder):
+    s4 = build()
+    assert Scheduler(workers=2, logger=logger).run(["4", "5"], s4, collect=True) == [20, 25]
+    broken = Task(fail, "2019-04-26T17:12", file_cacher=ZlibCacher)(s4)
+    with pytest.raises(ValueError):
+        Scheduler(workers=2, logger=logger).run(["4"], broken)
@@ -0,0 +1,105 @@
+from typing import Any
+from multiprocessing import Process
+from time import sleep, time
+import logging
+import os
+import pytest
+from pypedream import Task, Input, InputObj, ZlibCacher, Executor, CaseContext, run_shard, merge_shards
+from pypedream.lease import Lease
+from pypedream.shard import shard_cases
+
+logger = logging.getLogger("pypedream-test")
+
+class NumberInput(InputObj):
+    def load(self, *args) -> Any:
+        return int(self.name)
+
+    def time(self) -> float:
+        return 1.0
+
+def slow_square(x):
+    """Leaves a file per call, so the test can count computes across processes."""
+    with open(os.path.join(str(Task.save_folder), f"call-{x}-{os.getpid()}-{time()}"), 'w'):
+        pass
+    sleep(0.05)
+    return x * x
+
+def halve(x):
+    return x / 2
+
+def build():
+    source = Input(NumberInput, "2019-04-26T17:12")
+    s1 = Task(slow_square, "2019-04-26T17:12", file_cacher=ZlibCacher)(source)
+    s2 = Task(halve, "2019-04-26T17:12", file_cacher=ZlibCacher)(s1)
+    return s1, s2
+
+def test_shard_cases():
+    cases = [str(x) for x in range(10)]
+    for by in ("index", "hash"):
+        shards = [shard_cases(cases, shard, 3, by) for shard in range(3)]
+        assert sorted(case for shard in shards for case in shard) == cases
+        assert shards == [shard_cases(cases, shard, 3, by) for shard in range(3)]
+    assert shard_cases(cases, 0, 3) == ["0", "1", "2"]
+
+def test_lease(tmp_path):
+    with Lease(tmp_path, "case", ttl=1.) as lease:
+        assert not lease.waited and lease.path.exists()
+        other = Lease(tmp_path, "case", ttl=1., poll=0.01)
+        assert not other._create()
+    assert not lease.path.exists()
+    lease.path.write_text("crashed holder")
+    os.utime(str(lease.path), (time() - 5, time() - 5))
+    with Lease(tmp_path, "case", ttl=1., poll=0.01) as lease:  # takes over the expired lease
+        assert lease.waited and lease.path.read_text() == lease.token
+
+def test_executor_lease(save_folder):
+    from threading import Timer
+    s1, _ = build()
+    lease = Lease(s1.path(), "3", ttl=5.)
+    lease.acquire()
+    Timer(0.5, lease.release).start()
+    start = time()
+    with Executor(workers=1, logger=logger, lease_ttl=5.) as executor:  # the lease travels with the job
+        assert executor.map(["3"], s1) == [9]
+    assert time() - start >= 0.5
+
+def test_lease_recheck(save_folder):
+    s1, _ = build()
+    late = CaseContext("4", logger, lease_ttl=5.)
+    assert late.resolve(s1).stale
+    assert CaseContext("4", logger, lease_ttl=5.).run([s1]) == [16]  # another node, done before `late` leases
+    assert late.run([s1]) == [16]
+    assert len(list(save_folder.glob("call-4-*"))) == 1
+
+def test_run_shards(save_folder):
+    s1, s2 = build()
+    cases = [str(x) for x in range(12)]
+    # every node runs both outputs of its cases, so nodes of the "all" run contend for the same slow_square cases
+    nodes = [Process(target=run_shard, args=(cases, [s1, s2], shard, 3),
+                     kwargs={"by": "hash", "name": "all", "workers": 2, "lease_ttl": 5., "logger": logger})
+             for shard in range(3)]
+    nodes += [Process(target=run_shard, args=(cases, s2, shard, 2),
+                      kwargs={"name": "halves", "workers": 2, "lease_ttl": 5., "logger": logger})
+              for shard in range(2)]
+    for node in nodes:
+        node.start()
+    for node in nodes:
+        node.join()
+        assert node.exitcode == 0
+    assert len(list(save_folder.glob("call-*"))) == len(cases)
+    assert not list(save_folder.joinpath("slow_square", ".leases").iterdir())
+    squares, halves = merge_shards("all")[0]
+    assert squares == [x * x for x in range(12)] and halves == [x * x / 2 for x in range(12)]
+    results, total = merge_shards("halves")
+    assert results == halves
+    summary = total.summary()
+    assert summary["halve"]["hits"] + summary["halve"]["misses"] == len(cases)
+    computes = merge_shards("all")[1].summary()["slow_square"]["compute_count"] + \
+        summary.get("slow_square", {"compute_count": 0})["compute_count"]
+    assert computes == len(cases)
+
+def test_merge_missing(save_folder):
+    _, s2 = build()
+    run_shard(["1", "2", "3"], s2, 0, 2, name="partial", workers=1, logger=logger)
+    with pytest.raises(FileNotFoundError):
+        merge_shards("partial")
@@ -17,7 +17,6 @@ def test_linear():
     print(list(a))
     assert(perf_counter() - old_time < 0.7)
 
-test_linear()
 ##
 def slow_add3(x, y):
     sleep(0.5)
@@ -30,5 +29,4 @@ def test_bifurcate():
     _ = pr.map(slow_add3, [step1, step1_2], workers=4) | list
     assert(perf_counter() - old_time < 1.0)
 
-test_bifurcate()
 ##
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import pytest
+from pypedream import process as pr, thread as th, asyncio_task as aio
+
+def add1(x):
+    return x + 1
+
+async def double(x):
+    await asyncio.sleep(0.01)
+    return x * 2
+
+async def is_even(x):
+    return x % 2 == 0
+
+async def numbers(count):
+    for x in range(count):
+        await asyncio.sleep(0)
+        yield x
+
+def fail_on_5(x):
+    if x == 5:
+        raise ValueError("five")
+    return x
+
+def test_thread():
+    lock = threading.Lock()  # not picklable, so items must stay in this process
+    stage = range(50) | th.map(lambda x: (x, lock), workers=4) | th.filter(lambda item: item[0] % 2, workers=2)
+    assert sorted(x for x, _ in stage) == list(range(1, 50, 2))
+    assert list(range(20) | th.map(add1, workers=3, ordered=True, window=4, chunksize=3)) == list(range(1, 21))
+
+def test_asyncio():
+    stage = numbers(40) | aio.map(double, workers=20) | aio.filter(is_even, workers=5)
+    assert sorted(stage) == list(range(0, 80, 2))
+    assert list(range(30) | aio.map(double, workers=8, ordered=True, window=8)) == list(range(0, 60, 2))
+
+def test_mixed():
+    stage = th.from_iterable(range(100), chunksize=8) | pr.map(add1, workers=2) | aio.map(double, workers=10)
+    stage = th.concat([stage, range(3)]) | pr.filter(lambda x: x > 0, workers=2, chunksize=4)
+    assert sorted(stage) == sorted([2 * x for x in range(1, 101)] + [1, 2])
+
+def test_thread_error():
+    with pytest.raises(ValueError):
+        list(range(10) | th.map(fail_on_5, workers=2) | aio.map(double))
+
+def test_asyncio_hooks():
+    events = []
+
+    async def on_start():
+        return 10
+
+    async def add(x, offset):
+        return x + offset
+
+    def on_done(status, offset):
+        events.append((status.done, offset))
+
+    assert sorted(range(5) | aio.map(add, workers=3, on_start=on_start, on_done=on_done)) == list(range(10, 15))
+    assert events == [(True, 10)]